@@ -0,0 +1,4 @@
+"""Throughput benchmarks of the SQuaLity parsers, comparators and runners.
+
+Run them with `python3 -m benchmarks`, see `python3 -m benchmarks -h` for the options.
+"""
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .workloads import get_workloads
+
+DEFAULT_OUTPUT = "output/benchmarks/{}.json"
+DEFAULT_BASELINE = "output/benchmarks/baseline.json"
+
+
+def measure(run, repeat: int):
+    """run the workload several times and keep the fastest run
+    """
+    best = None
+    ops = 0
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        ops = run()
+        seconds = time.perf_counter() - begin
+        best = seconds if best is None else min(best, seconds)
+    return {'ops': ops, 'seconds': best, 'ops_per_sec': ops / best if best else 0.0}
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """compare the results to the baseline and print the table
+
+    Returns:
+        list: the workloads that are slower than the baseline by more than the threshold
+    """
+    regressions = []
+    print("%-32s %14s %14s %9s" % ("workload", "ops/sec", "baseline", "change"))
+    for name, result in results.items():
+        speed = result['ops_per_sec']
+        if name not in baseline:
+            print("%-32s %14.1f %14s %9s" % (name, speed, "-", "-"))
+            continue
+        base_speed = baseline[name]['ops_per_sec']
+        change = speed / base_speed - 1 if base_speed else 0.0
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print("%-32s %14.1f %14.1f %+8.1f%%%s" %
+              (name, speed, base_speed, change * 100, flag))
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="python3 -m benchmarks",
+                                         description="Measure the throughput of the parsers, comparators and runners.")
+    arg_parser.add_argument('-w', '--workload', action='append', default=[],
+                            help="Run the workloads whose name starts with it, e.g. parser or compare/row_wise. Could be repeated. Defaults to all.")
+    arg_parser.add_argument('-r', '--repeat', type=int, default=3,
+                            help="Run each workload this many times and keep the fastest run")
+    arg_parser.add_argument('-o', '--output', type=str, default="",
+                            help="The json file to save the results. Defaults to output/benchmarks/<date>.json")
+    arg_parser.add_argument('-b', '--baseline', type=str, default=DEFAULT_BASELINE,
+                            help="The json file of the baseline results to compare with")
+    arg_parser.add_argument('--save_baseline', action='store_true',
+                            help="If added, it would also save the results as the new baseline")
+    arg_parser.add_argument('--threshold', type=float, default=0.1,
+                            help="Report a regression if a workload is slower than the baseline by more than this ratio")
+    arg_parser.add_argument('-l', '--list', action='store_true',
+                            help="List the workloads and exit")
+    args = arg_parser.parse_args()
+
+    # the parsers and runners log every mismatch, which is not what we measure
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        workloads = get_workloads(fixture_dir)
+        if args.list:
+            print("\n".join(workloads))
+            return 0
+        names = [name for name in workloads if not args.workload or any(
+            name.startswith(prefix) for prefix in args.workload)]
+        if not names:
+            sys.exit("No workload matches %s" % args.workload)
+
+        results = {}
+        for name in names:
+            run = workloads[name]()
+            results[name] = measure(run, args.repeat)
+
+    report = {'date': datetime.now().strftime("%y-%m-%d-%H:%M"),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'repeat': args.repeat,
+              'results': results}
+    output = args.output or DEFAULT_OUTPUT.format(
+        datetime.now().strftime("%y-%m-%d-%H%M%S"))
+    # the first run on a machine becomes its baseline, the baseline is never shipped with the repo
+    save_baseline = args.save_baseline or not os.path.exists(args.baseline)
+    if save_baseline and not args.save_baseline:
+        print("No baseline at %s, save this run as the baseline" % args.baseline)
+    paths = [output] + ([args.baseline] if save_baseline else [])
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if not save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+    print("Results saved to %s" % output)
+    if regressions:
+        print("%d workloads regressed more than %.0f%% against %s: %s" % (
+            len(regressions), args.threshold * 100, args.baseline, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""The fixed workloads of the benchmark suite.
+
+Each workload does its set up once and returns a function that runs it once and returns the
+number of operations (records, comparisons) it did.
+"""
+import glob
+import os
+import random
+from copy import copy
+
+from src import testparser
+from src import testrunner
+from src.utils import Query, ResultFormat, ResultHelper, SortType
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLT_FILES = sorted(glob.glob(os.path.join(BASE_DIR, 'demo', '*.test')))
+CSV_FILES = sorted(glob.glob(os.path.join(BASE_DIR, 'data', 'cornercase', '*')))
+
+# a result set with integer, float and text columns
+RESULT_ROWS = 2000
+RESULT_TYPES = 'IRT'
+SEED = 2023
+
+
+def parse_files(parser: testparser.Parser, files):
+    records = 0
+    for file_name in files:
+        parser.get_file_name(file_name)
+        parser.get_file_content()
+        parser.parse_file()
+        records += len(parser.get_records())
+    return records
+
+
+def write_pg_fixture(fixture_dir: str):
+    """write a PostgreSQL regression test and its expected output, as there is no one bundled
+    """
+    sql_lines = ["CREATE TABLE bench (a int, b text);"]
+    out_lines = ["CREATE TABLE bench (a int, b text);"]
+    for i in range(200):
+        sql_lines.append("INSERT INTO bench VALUES (%d, 'v%d');" % (i, i))
+        out_lines.append("INSERT INTO bench VALUES (%d, 'v%d');" % (i, i))
+    for i in range(100):
+        query = "SELECT a, b FROM bench WHERE a = %d;" % i
+        sql_lines.append(query)
+        out_lines += [query, " a | b ", "---+----",
+                      " %d | v%d" % (i, i), "(1 row)", ""]
+        sql_lines.append("SELECT a FROM nothing_%d;" % i)
+        out_lines += ["SELECT a FROM nothing_%d;" % i,
+                      "ERROR:  relation \"nothing_%d\" does not exist" % i]
+    os.makedirs(os.path.join(fixture_dir, 'sql'), exist_ok=True)
+    os.makedirs(os.path.join(fixture_dir, 'expected'), exist_ok=True)
+    sql_file = os.path.join(fixture_dir, 'sql', 'bench.sql')
+    with open(sql_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(sql_lines) + '\n')
+    with open(os.path.join(fixture_dir, 'expected', 'bench.out'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(out_lines) + '\n')
+    return sql_file
+
+
+def synthetic_results(rows=RESULT_ROWS):
+    rand = random.Random(SEED)
+    return [(rand.randint(-10000, 10000), rand.uniform(-1000, 1000),
+             rand.choice(['abc', 'def', 'xyz', None]) if i % 7 else None) for i in range(rows)]
+
+
+def parser_workload(parser_class, files):
+    def run():
+        return parse_files(parser_class(), files)
+    return run
+
+
+def pg_parser_workload(fixture_dir: str):
+    sql_file = write_pg_fixture(fixture_dir)
+
+    def run():
+        return parse_files(testparser.PGTParser(), [sql_file])
+    return run
+
+
+def value_wise_workload(sort: SortType, hashing: bool):
+    results = synthetic_results()
+    query = Query(sql="SELECT 1", data_type=RESULT_TYPES, sort=sort, id=0)
+    threshold = 8 if hashing else len(results) * len(RESULT_TYPES)
+    _, query.result = ResultHelper(results, query).value_wise_compare(
+        results, query, threshold)
+
+    def run():
+        flag, _ = ResultHelper(results, query).value_wise_compare(
+            results, query, threshold)
+        assert flag
+        return len(results)
+    return run
+
+
+def row_wise_workload(shuffle: bool):
+    results = synthetic_results()
+    expected = '\n'.join(['\t'.join(['NULL' if item is None else str(item) for item in row])
+                          for row in results])
+    actual = copy(results)
+    if shuffle:
+        # the comparison only passes after sorting
+        random.Random(SEED).shuffle(actual)
+    query = Query(sql="SELECT 1", result=expected, data_type=RESULT_TYPES,
+                  res_format=ResultFormat.ROW_WISE, id=0)
+
+    def run():
+        flag, _ = ResultHelper(actual, query).row_wise_compare(actual, query)
+        assert flag
+        return len(actual)
+    return run
+
+
+def hash_format_workload():
+    """the ResultFormat.HASH queries of the DuckDB suite
+    """
+    results = synthetic_results()
+    runner = testrunner.DuckDBRunner()
+    runner.init_dumper(write_files=False)
+    result_string = '\n'.join(['\n'.join([str(item) if item != None else 'NULL' for item in row])
+                               for row in results]) + '\n'
+    query = Query(sql="SELECT 1", data_type=RESULT_TYPES,
+                  res_format=ResultFormat.HASH, id=0)
+    query.result = "%d values hashing to %s" % (len(results) * len(RESULT_TYPES),
+                                                ResultHelper(results, query).hash_results(result_string))
+
+    def run():
+        runner.records_log = []
+        runner.single_run_stats['wrong_query_num'] = 0
+        runner.handle_query_result(results, query)
+        assert runner.single_run_stats['wrong_query_num'] == 0
+        return len(results)
+    return run
+
+
+def runner_workload(runner_class, files, columnar=False):
+    records_list = []
+    for file_name in files:
+        parser = testparser.SLTParser()
+        parse_files(parser, [file_name])
+        records_list.append((file_name, parser.get_records()))
+    runner = runner_class()
+    if columnar:
+        runner.set_columnar()
+    runner.init_dumper(write_files=False)
+
+    def run():
+        records_num = 0
+        for i, (file_name, records) in enumerate(records_list):
+            runner.set_db(':memory:')
+            runner.get_records(copy(records), i, file_name)
+            runner.connect(':memory:')
+            runner.run()
+            runner.close()
+            records_num += len(records)
+        return records_num
+    return run
+
+
+def large_query_workload(columnar: bool):
+    """a value-wise DuckDB query with a large result, compared once unhashed and once hashed
+    """
+    sql = "SELECT range, range / 7, 'v' || (range %% 97) FROM range(%d)" % (RESULT_ROWS * 50)
+    runner = testrunner.DuckDBRunner()
+    if columnar:
+        runner.set_columnar()
+    runner.init_dumper(write_files=False)
+    runner.set_db(':memory:')
+    runner.connect(':memory:')
+    records = [Query(sql=sql, data_type='IRT', sort=SortType.ROW_SORT, id=0, is_hash=False),
+               Query(sql=sql, data_type='IRT', sort=SortType.ROW_SORT, id=1)]
+    records[0].result = ResultHelper([], records[0]).value_wise_compare(
+        runner.execute_query(sql), records[0], 0, False)[1]
+    records[1].result = ResultHelper([], records[1]).value_wise_compare(
+        runner.execute_query(sql), records[1], 0)[1]
+
+    def run():
+        runner.get_records(copy(records), 0, "large")
+        runner.run()
+        assert runner.allright
+        return len(records)
+    return run
+
+
+def get_workloads(fixture_dir: str):
+    """get all the workloads by name, the set up of each one is delayed until it is picked
+    """
+    return {
+        'parser/slt': lambda: parser_workload(testparser.SLTParser, SLT_FILES),
+        'parser/duckdb': lambda: parser_workload(testparser.DTParser, SLT_FILES),
+        'parser/postgresql': lambda: pg_parser_workload(fixture_dir),
+        'parser/csv': lambda: parser_workload(testparser.CSVParser, CSV_FILES),
+        'compare/value_wise_nosort': lambda: value_wise_workload(SortType.NO_SORT, False),
+        'compare/value_wise_rowsort': lambda: value_wise_workload(SortType.ROW_SORT, False),
+        'compare/value_wise_valuesort': lambda: value_wise_workload(SortType.VALUE_SORT, False),
+        'compare/value_wise_hash': lambda: value_wise_workload(SortType.NO_SORT, True),
+        'compare/row_wise': lambda: row_wise_workload(False),
+        'compare/row_wise_sorted': lambda: row_wise_workload(True),
+        'compare/hash_format': hash_format_workload,
+        'runner/sqlite': lambda: runner_workload(testrunner.SQLiteRunner, SLT_FILES),
+        'runner/duckdb': lambda: runner_workload(testrunner.DuckDBRunner, SLT_FILES),
+        'runner/duckdb_columnar': lambda: runner_workload(testrunner.DuckDBRunner, SLT_FILES, columnar=True),
+        'runner/duckdb_large': lambda: large_query_workload(False),
+        'runner/duckdb_large_columnar': lambda: large_query_workload(True),
+    }
@@ -2,9 +2,11 @@
 
 import argparse
 import os
+import shutil
 import sys
 import traceback
 import logging
+import multiprocessing
 from datetime import datetime
 
 
@@ -12,7 +14,131 @@ from src import testparser
 from src import testrunner
 from src import testcollector
 from src import config
-from src.utils import DBMS_Set, Suite_Set, SETUP_PATH
+from src.parsecache import ParseCache
+from src.checkpoint import Checkpoint
+from src.prefixsnapshot import PrefixSnapshots
+from src.utils import DBMS_Set, Suite_Set, SETUP_PATH, OUTPUT_PATH
+
+# per-process state of a --jobs worker, filled by init_worker
+WORKER = {}
+
+
+def get_parser(suite_name: str):
+    if suite_name == 'sqlite':
+        return testparser.SLTParser()
+    elif suite_name == 'duckdb':
+        return testparser.DTParser()
+    elif suite_name == 'squality':
+        return testparser.CSVParser()
+    elif suite_name == 'postgresql':
+        return testparser.PGTParser(SETUP_PATH['postgresql'])
+    sys.exit("Not implement yet")
+
+
+def get_runner(dbms_name: str, in_memory=False, snapshot=False, columnar=False, batch_size=0):
+    if dbms_name == 'sqlite':
+        r = testrunner.SQLiteRunner()
+        if in_memory:
+            r.set_in_memory(snapshot)
+        r.set_batch(batch_size)
+        return r
+    elif dbms_name == 'duckdb':
+        r = testrunner.DuckDBRunner()
+        if columnar:
+            r.set_columnar()
+        r.set_batch(batch_size)
+        return r
+    elif dbms_name == 'cockroachdb':
+        return testrunner.CockroachDBRunner()
+    elif dbms_name == 'mysql':
+        return testrunner.MySQLRunner()
+    elif dbms_name == 'postgresql':
+        return testrunner.PostgreSQLRunner()
+    elif dbms_name == 'psql':
+        return testrunner.PSQLRunner()
+    sys.exit("Not implement yet")
+
+
+def run_test_file(p: testparser.Parser, r: testrunner.Runner, i: int, test_file: str, db_name: str, log_level: str,
+                  cache: ParseCache = None, prefixes: PrefixSnapshots = None):
+    """parse a single test file (or load it from the parse cache) and run it on the runner
+
+    Returns:
+        int: the running time (seconds) of this test file
+    """
+    single_begin_time = datetime.now()
+    r.timer.start_file()
+    logging.info("test file %d", i)
+    logging.info("parsing %s", test_file)
+    with r.timer.phase('parse'):
+        if cache is not None:
+            records = cache.parse(p, test_file)
+        else:
+            # the records are parsed lazily while the runner consumes them
+            p.get_file_name(test_file)
+            records = p.iter_records()
+
+    with r.timer.phase('connect'):
+        if prefixes is not None:
+            r.set_prefix_snapshot(*prefixes.get(test_file))
+        r.set_db(db_name)
+    r.get_records(records, testfile_index=i,
+                  testfile_path=test_file)
+    with r.timer.phase('connect'):
+        r.connect(db_name)
+    logging.info("running %s", test_file)
+    try:
+        r.run()
+    except Exception as e:
+        logging.critical(
+            "Runner catch an exception %s , it is either the runner's bug or the connector's bug.", e)
+        logging.info(traceback.format_exc())
+        r.not_allright()
+        r.close()
+    else:
+        r.close()
+        if log_level != "DEBUG":
+            r.remove_db(db_name)
+    return (datetime.now() - single_begin_time).seconds
+
+
+def init_worker(worker_ids, suite_name: str, dbms_name: str, filter_flaky: bool, dump_all: bool,
+                db_name: str, log_file: str, log_level: str, parse_cache: bool, in_memory: bool, snapshot: bool,
+                columnar: bool, batch_size: int, prefixes: PrefixSnapshots, part_dir: str):
+    """set up the parser, runner and database of a --jobs worker process
+    """
+    worker_id = worker_ids.get()
+    logging.basicConfig(filename="%s.worker%d" % (log_file, worker_id), encoding='utf-8',
+                        level=getattr(logging, log_level.upper()), force=True)
+    r = get_runner(dbms_name, in_memory, snapshot, columnar, batch_size)
+    r.init_filter(filter_flaky)
+    # the worker dumps each test file to its own csv files, the parent process merges them
+    r.init_dumper(dump_all=dump_all, suite_name=suite_name, part_dir=part_dir)
+    WORKER['parser'] = get_parser(suite_name)
+    WORKER['runner'] = r
+    WORKER['db_name'] = "%s_%d" % (db_name, worker_id)
+    WORKER['log_level'] = log_level
+    WORKER['cache'] = ParseCache() if parse_cache else None
+    if prefixes is not None:
+        prefixes.bind(r, WORKER['db_name'])
+    WORKER['prefixes'] = prefixes
+
+
+def run_worker_file(task):
+    """run a single test file in a --jobs worker, dump it to its csv files and send back the stats
+    """
+    i, test_file = task
+    r = WORKER['runner']
+    log_base = r.bug_dumper.log_index
+    running_time = run_test_file(WORKER['parser'], r, i, test_file,
+                                 WORKER['db_name'], WORKER['log_level'], WORKER['cache'], WORKER['prefixes'])
+    r.count_success_file()
+    with r.timer.phase('dump'):
+        r.bug_dumper.flush(r.dbms_name)
+    r.timer.end_file()
+    return (i, test_file, running_time, r.single_run_stats, r.timer.file_times,
+            log_base, r.bug_dumper.log_index - log_base)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -35,6 +161,25 @@ if __name__ == "__main__":
                         help="Max test files it run. Negative value means skipping the absolute number of test files")
     parser.add_argument('--dump_all', action='store_true',
                         help="If added, it would dump every testcases to csv, besides error cases.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of worker processes running the test files in parallel. "
+                        "Each worker uses its own database named DB_NAME_<worker id>.")
+    parser.add_argument('--parse_cache', action='store_true',
+                        help="If added, it would cache the parsed test files in output/parse_cache and reuse them while the files are unchanged.")
+    parser.add_argument('--resume', action='store_true',
+                        help="If added, it would skip the test files finished by the last (interrupted) run and append to its output csv files.")
+    parser.add_argument('--in_memory', action='store_true',
+                        help="If added, SQLite runs every test file in an in-memory database instead of the DB_NAME file.")
+    parser.add_argument('--failed_snapshot', action='store_true',
+                        help="Only with --in_memory. If added, the database of a test file with errors is saved to DB_NAME_<test file index>.db")
+    parser.add_argument('--columnar', action='store_true',
+                        help="If added, DuckDB fetches the results of the value-wise and hashed queries column by column with fetchnumpy.")
+    parser.add_argument('--prefix_snapshot', action='store_true',
+                        help="If added, the leading CREATE/INSERT statements shared by several test files run once, "
+                        "and the files start from a snapshot of them (SQLite, DuckDB and PostgreSQL).")
+    parser.add_argument('--batch', type=int, default=0,
+                        help="If > 1, up to BATCH consecutive CREATE/INSERT statements expected to succeed run in one transaction. "
+                        "A failed batch is rolled back and bisected down to the failed statement (SQLite and DuckDB).")
 
     args = parser.parse_args()
     dbms_name = str.lower(args.dbms)
@@ -45,7 +190,14 @@ if __name__ == "__main__":
     filter_flaky = args.filter
     test_file = args.test_file
     log_level = args.log
-    
+    jobs = args.jobs
+    if args.in_memory and dbms_name != 'sqlite':
+        sys.exit("--in_memory only supports sqlite")
+    if args.columnar and dbms_name != 'duckdb':
+        sys.exit("--columnar only supports duckdb")
+    if args.batch > 1 and dbms_name not in ('sqlite', 'duckdb'):
+        sys.exit("--batch only supports sqlite and duckdb")
+
     conf = config.CONFIG
     with open(conf['bad_files'], "r") as f:
         bad_files = f.readlines()
@@ -67,49 +219,34 @@ if __name__ == "__main__":
                             level=getattr(logging, log_level.upper()),)
         sys.stdout = open(log_file + ".out", "a", encoding='utf-8')
     else:
-        logging.basicConfig(filename="logs/debug.log", encoding='utf-8',
+        log_file = "logs/debug.log"
+        logging.basicConfig(filename=log_file, encoding='utf-8',
                             level=getattr(logging, log_level.upper()), filemode='w')
         sys.stdout = open("logs/debug" + ".out", "w", encoding='utf-8')
 
-    # set the parser
-    if suite_name == 'sqlite':
-        p = testparser.SLTParser()
-    elif suite_name == 'duckdb':
-        p = testparser.DTParser()
-    elif suite_name == 'squality':
-        p = testparser.CSVParser()
-    elif suite_name == 'postgresql':
-        p = testparser.PGTParser(SETUP_PATH['postgresql'])
+    # set the runner, in --jobs mode it only merges and summarizes the workers' results
+    r = get_runner(dbms_name, args.in_memory,
+                   args.failed_snapshot, args.columnar, args.batch)
+    r.init_filter(filter_flaky)
+    r.init_dumper(dump_all=args.dump_all,
+                  suite_name=suite_name, resume=args.resume)
+    checkpoint = Checkpoint(r.bug_dumper.dbms_name + r.bug_dumper.suffix)
+    if args.resume and checkpoint.load():
+        last_entry = checkpoint.last_entry
+        r.bug_dumper.resume(last_entry['offsets'], last_entry['log_index'])
+        r.all_run_stats = checkpoint.get_stats()
     else:
-        sys.exit("Not implement yet")
+        if args.resume:
+            print("Nothing to resume, start a new run")
+            r.bug_dumper.init_bugs_schema()
+        checkpoint.reset()
 
-    # set the runner
-    if dbms_name == 'sqlite':
-        r = testrunner.SQLiteRunner()
-    elif dbms_name == 'duckdb':
-        r = testrunner.DuckDBRunner()
-    elif dbms_name == 'cockroachdb':
-        r = testrunner.CockroachDBRunner()
-    elif dbms_name == 'mysql':
-        r = testrunner.MySQLRunner()
-    elif dbms_name == 'postgresql':
-        r = testrunner.PostgreSQLRunner()
-    elif dbms_name == 'psql':
-        r = testrunner.PSQLRunner()
-    else:
-        sys.exit("Not implement yet")
-    r.init_filter(filter_flaky)
-    r.init_dumper(dump_all=args.dump_all, suite_name=suite_name, )
+    # pick the test files to run
     skip_index = []
     skip_file_num = 0
+    resume_file_num = 0
+    tasks = []
     for i, test_file in enumerate(test_files):
-        # if test_file == "postgresql_tests/regress/sql/select.sql":
-        #     logging.getLogger().setLevel(logging.DEBUG)
-        # else:
-        #     logging.getLogger().setLevel(getattr(logging, log_level.upper()))
-        db_name = args.db_name
-        single_begin_time = datetime.now()
-        
         # skip some files
         if i in skip_index:
             skip_file_num += 1
@@ -123,37 +260,75 @@ if __name__ == "__main__":
         if test_file in bad_files:
             skip_file_num += 1
             continue
-        # print("-----------------------------------")
-        logging.info("test file %d", i)
-        logging.info("parsing %s", test_file)
-        p.get_file_name(test_file)
-        p.get_file_content()
-        p.parse_file()
+        if checkpoint.is_finished(i, test_file):
+            resume_file_num += 1
+            continue
+        tasks.append((i, test_file))
 
-        r.set_db(db_name)
-        r.get_records(p.get_records(), testfile_index=i,
-                      testfile_path=test_file)
-        r.connect(db_name)
-        # print("-----------------------------------")
-        logging.info("running %s", test_file)
-        try:
-            r.run()
-            # r.commit()
-        except Exception as e:
-            logging.critical(
-                "Runner catch an exception %s , it is either the runner's bug or the connector's bug.", e)
-            logging.info(traceback.format_exc())
-            # r.commit()
-            r.not_allright()
-            r.close()
-        else:
-            r.close()
-            if log_level != "DEBUG":
-                r.remove_db(db_name)
-        single_end_time = datetime.now()
-        single_running_time = (single_end_time - single_begin_time).seconds
-        r.running_summary(str(i) + " " + test_file, single_running_time)
-        # print ("#############################\n\n")
-        r.dump()
+    # find the statements that the test files start with in common
+    prefixes = None
+    if args.prefix_snapshot and r.supports_prefix_snapshot(args.db_name):
+        prefixes = PrefixSnapshots(r.dbms_name)
+        p = get_parser(suite_name)
+        cache = ParseCache() if args.parse_cache else None
+        for i, test_file in tasks:
+            if r.is_filtered(test_file):
+                continue
+            if cache is not None:
+                records = cache.parse(p, test_file)
+            else:
+                # only the leading statements are parsed
+                p.get_file_name(test_file)
+                records = p.iter_records()
+            prefixes.add_file(test_file, records)
+        prefixes.plan()
+    elif args.prefix_snapshot:
+        print("%s could not share the prefixes with %s" % (dbms_name, args.db_name))
+
+    if jobs > 1:
+        sys.stdout.flush()
+        part_dir = OUTPUT_PATH['execution_parts'].format(
+            r.bug_dumper.dbms_name + r.bug_dumper.suffix)
+        # the parts left by an interrupted run are not finished, they are dumped again
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.makedirs(part_dir)
+        worker_ids = multiprocessing.Queue()
+        for worker_id in range(jobs):
+            worker_ids.put(worker_id)
+        with multiprocessing.Pool(jobs, initializer=init_worker,
+                                  initargs=(worker_ids, suite_name, dbms_name, filter_flaky, args.dump_all,
+                                            args.db_name, log_file, log_level, args.parse_cache,
+                                            args.in_memory, args.failed_snapshot, args.columnar, args.batch,
+                                            prefixes, part_dir)) as pool:
+            # one file per task, so the slow files don't hold up a whole shard
+            for i, test_file, running_time, stats, file_times, log_base, log_num in pool.imap_unordered(run_worker_file, tasks):
+                r.bug_dumper.get_testfile_data(
+                    testfile_index=i, testfile_path=test_file)
+                r.bug_dumper.merge_part(part_dir, i, log_base, log_num)
+                r.timer.merge_file(file_times)
+                r.running_summary(str(i) + " " + test_file, running_time, stats)
+                r.dump()
+                checkpoint.add(i, test_file, stats, r.bug_dumper.get_output_paths(),
+                               r.bug_dumper.log_index)
+        shutil.rmtree(part_dir, ignore_errors=True)
+    else:
+        p = get_parser(suite_name)
+        cache = ParseCache() if args.parse_cache else None
+        if prefixes is not None:
+            prefixes.bind(r, args.db_name)
+        for i, test_file in tasks:
+            single_running_time = run_test_file(
+                p, r, i, test_file, args.db_name, log_level, cache, prefixes)
+            r.running_summary(str(i) + " " + test_file, single_running_time)
+            r.dump()
+            checkpoint.add(i, test_file, r.single_run_stats, r.bug_dumper.get_output_paths(),
+                           r.bug_dumper.log_index)
+    if prefixes is not None:
+        db_names = [args.db_name] if jobs <= 1 else [
+            "%s_%d" % (args.db_name, worker_id) for worker_id in range(jobs)]
+        for name in db_names:
+            prefixes.drop_all(r, name)
     r.running_summary("ALL", (datetime.now()-begin_time).seconds)
     print("Totally skip %d files" % skip_file_num)
+    if resume_file_num:
+        print("Resume from %d finished files" % resume_file_num)
@@ -1,58 +1,179 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
+import multiprocessing
 import os
 import sys
 SCRIPDIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPDIR))
 from src.testcollector import TestcaseCollector, find_local_tests
+from src.parsecache import get_parse_key
 from src import utils
 from src import testparser
 
+MANIFEST_NAME = "extract_manifest.json"
+WORKER = {}
 
-def extract(dbms_name: str, parser: testparser.Parser, compression: bool = True):
-    collector = TestcaseCollector()
-    test_files = find_local_tests(dbms_name)
-    os.system("mkdir data/{} -p".format(dbms_name))
 
-    for i, test_file in enumerate(test_files):
-        # parse the file to get records
-        print(test_file)
-        parser.get_file_name(test_file)
-        parser.get_file_content()
-        parser.parse_file()
+def load_manifest(path: str):
+    """load the source file -> {key, output} manifest of the last extraction
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path: str, manifest: dict):
+    # write to a temp file first, so an interrupted extraction keeps the old manifest
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def update_manifest(manifest: dict, test_file: str, key: str, output_path: str):
+    if output_path is None:
+        # the dump failed, the file is extracted again next time instead of keeping its old output
+        manifest.pop(test_file, None)
+        return
+    # the output in the other format is replaced by the new one
+    entry = manifest.get(test_file)
+    if entry is not None and entry['output'] != output_path:
+        try:
+            os.remove(entry['output'])
+        except FileNotFoundError:
+            pass
+    manifest[test_file] = {'key': key, 'output': output_path}
+
+
+def init_worker(dbms_name: str, parser: testparser.Parser, compression: bool, file_format: str):
+    WORKER['dbms_name'] = dbms_name
+    WORKER['parser'] = parser
+    WORKER['collector'] = TestcaseCollector()
+    WORKER['compression'] = compression
+    WORKER['file_format'] = file_format
+
 
-        # save the records to a csv
-        testcase_name = utils.convert_testfile_name(test_file, dbms_name)
-        records = parser.get_records()
-        print(len(records))
+def extract_file(task):
+    """parse a single test file and dump its records to a csv or parquet file
 
-        collector.init_testcase_schema(dbms_name, testcase_name, compression)
-        collector.save_records(records)
+    Returns:
+        Tuple[str, str, str, int]: the test file, its key, the output path (None if it could not be
+            dumped) and the number of records
+    """
+    test_file, key = task
+    dbms_name = WORKER['dbms_name']
+    parser = WORKER['parser']
+    collector = WORKER['collector']
+
+    # parse the file to get records
+    parser.get_file_name(test_file)
+    parser.get_file_content()
+    parser.parse_file()
+
+    # save the records to a csv or parquet file
+    testcase_name = utils.convert_testfile_name(test_file, dbms_name)
+    records = parser.get_records()
+
+    collector.init_testcase_schema(dbms_name, testcase_name, WORKER['compression'], WORKER['file_format'])
+    collector.save_records(records)
+    try:
+        collector.dump()
+    except Exception as e:
+        print("failed to dump", test_file, e)
+        return test_file, key, None, len(records)
+    return test_file, key, collector.output_path, len(records)
+
+
+def extract(dbms_name: str, parser: testparser.Parser, compression: bool = True, jobs: int = 1, force: bool = False,
+            file_format: str = 'csv'):
+    """extract the test cases of the new or changed test files into data/<dbms_name>/
+
+    Args:
+        dbms_name (str): the name of the test suite
+        parser (testparser.Parser): the parser of the test suite
+        compression (bool, optional): whether to zip the csv files. Defaults to True.
+        jobs (int, optional): the number of worker processes. Defaults to 1.
+        force (bool, optional): extract all the test files, even the unchanged ones. Defaults to False.
+        file_format (str, optional): csv, or parquet for the columnar corpus. Defaults to 'csv'.
+    """
+    test_files = find_local_tests(dbms_name)
+    os.system("mkdir data/{} -p".format(dbms_name))
+    manifest_path = os.path.join(
+        utils.OUTPUT_PATH['testcase_dir'], dbms_name, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    # prune the outputs of the deleted test files
+    current_files = set(test_files)
+    for test_file in [f for f in manifest if f not in current_files]:
+        output_path = manifest.pop(test_file)['output']
+        print("prune", output_path)
         try:
-            collector.dump_to_csv()
-        except Exception:
+            os.remove(output_path)
+        except FileNotFoundError:
             pass
-        # exit(0)
-    # print(parser.meta_data)
+
+    # only the new or changed test files are parsed again, or the ones extracted in another format
+    tasks = []
+    collector = TestcaseCollector()
+    for test_file in test_files:
+        parser.get_file_name(test_file)
+        key = get_parse_key(parser)
+        entry = manifest.get(test_file)
+        collector.init_testcase_schema(dbms_name, utils.convert_testfile_name(test_file, dbms_name),
+                                       compression, file_format)
+        if not force and key is not None and entry is not None and entry['key'] == key \
+                and entry['output'] == collector.output_path and os.path.exists(entry['output']):
+            continue
+        tasks.append((test_file, key))
+    print("%d of %d test files are new or changed" % (len(tasks), len(test_files)))
+
+    try:
+        if jobs > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(jobs, initializer=init_worker,
+                                      initargs=(dbms_name, parser, compression, file_format)) as pool:
+                # one file per task, so the large files don't hold up a whole shard
+                for test_file, key, output_path, record_num in pool.imap_unordered(extract_file, tasks):
+                    print(test_file, record_num)
+                    update_manifest(manifest, test_file, key, output_path)
+        else:
+            init_worker(dbms_name, parser, compression, file_format)
+            for task in tasks:
+                test_file, key, output_path, record_num = extract_file(task)
+                print(test_file, record_num)
+                update_manifest(manifest, test_file, key, output_path)
+    finally:
+        # keep what is extracted so far, even if a test file breaks the parser
+        save_manifest(manifest_path, manifest)
 
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument('-s', '--suite', choices={
                             'sqlite', 'duckdb', 'cockroachdb', 'all', 'postgresql', 'mysql'}, default='all')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                            help="The number of processes to parse the test files. Defaults to the number of CPUs")
+    arg_parser.add_argument('--force', action='store_true',
+                            help="If added, it would extract all the test files, not only the new or changed ones")
+    arg_parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                            help="The format of the extracted test files. parquet writes a typed columnar file per test file, "
+                            "which the readers load in one scan. Defaults to csv")
     args = arg_parser.parse_args()
     suite = args.suite
 
     # Extract SQL Logic Test (SQLite testcase)
     if suite == 'sqlite' or suite == 'all':
         slt_parser = testparser.SLTParser()
-        extract('sqlite', slt_parser)
+        extract('sqlite', slt_parser, jobs=args.jobs, force=args.force, file_format=args.format)
 
     # Extract DuckDB Test
     if suite == 'duckdb' or suite == 'all':
         ddt_parser = testparser.DTParser()
-        extract('duckdb', ddt_parser, compression=False)
+        extract('duckdb', ddt_parser, compression=False,
+                jobs=args.jobs, force=args.force, file_format=args.format)
 
     # # Extract CockroachDB test
     # if suite == 'cockroachdb' or suite == 'all':
@@ -66,4 +187,5 @@ if __name__ == "__main__":
 
     if suite == 'postgresql' or suite == 'all':
         postgres_parser = testparser.PGTParser()
-        extract('postgresql', postgres_parser, compression=False)
+        extract('postgresql', postgres_parser, compression=False,
+                jobs=args.jobs, force=args.force, file_format=args.format)
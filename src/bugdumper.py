@@ -1,17 +1,26 @@
-import sqlite3
+import csv
 import logging
+import os
+import shutil
 from datetime import datetime
+from time import perf_counter_ns
 from typing import List
-import pandas as pd
-from .utils import Statement, Record, my_debug, OUTPUT_PATH, ResultColumns
+from .utils import Statement, Record, PhaseTimer, my_debug, OUTPUT_PATH, ResultColumns, TimingColumns
 
 
 class BugDumper():
-    """Dump things to csv"""
-
-    def __init__(self, dbms_name, dump_all, suffix: str = "") -> None:
-        # self.conn = sqlite3.connect("database.db")
-        # self.cur = self.conn.cursor()
+    """Dump things to csv
+
+    The rows are buffered as plain tuples and appended to the csv files in batches, so the
+    memory (and the time) of a test file stays linear in its number of records.
+    """
+    # flush the buffered rows once there are this many of them
+    BATCH_SIZE = 1000
+    # or once their SQL and results take this many characters
+    MAX_BUFFER_SIZE = 64 << 20
+
+    def __init__(self, dbms_name, dump_all, suffix: str = "", write_files: bool = True, resume: bool = False,
+                 timer: PhaseTimer = None, part_dir: str = None) -> None:
         self.tables = ['DBMS_BUGS', 'BUG_LOGS', 'BUG_TEST_CASES']
         self.views = ['DBMS_BUGS_STATUS', 'ORACLES_AGGREGATED', 'TAGS_AGGREGATED',
                       'DBMS_BUGS_TRUE_POSITIVES', 'BUG_TEST_CASES_NO_FP',
@@ -19,32 +28,69 @@ class BugDumper():
         self.dbms_name = dbms_name
         self.suffix = suffix
         self.dump_all = dump_all
-        self.bugs_dataframe = pd.DataFrame()
-        self.logs_dataframe = pd.DataFrame()
+        self.bugs_rows = []
+        self.logs_rows = []
+        self.buffer_size = 0
+        # the index of the next result row of the current test file
+        self.row_index = 0
         self.testfile_path = ""
         self.testfile_index = 0
-        self.init_bugs_schema()
+        self.write_files = write_files
+        # a --jobs worker dumps each test file to its own csv files in part_dir, the parent merges them
+        self.part_dir = part_dir
+        self.timer = timer if timer is not None else PhaseTimer()
+        self.results_path = OUTPUT_PATH['execution_result'].format(
+            dbms_name + suffix)
+        self.logs_path = OUTPUT_PATH['execution_log'].format(
+            dbms_name + suffix)
+        self.timing_path = OUTPUT_PATH['execution_timing'].format(
+            dbms_name + suffix)
+        self.init_bugs_schema(resume)
 
     def reset_schema(self):
-        self.bugs_dataframe = pd.DataFrame(columns=self.bugs_columns)
-        self.logs_dataframe = pd.DataFrame(columns=self.logs_columns)
-
-    def init_bugs_schema(self):
+        self.bugs_rows = []
+        self.logs_rows = []
+        self.buffer_size = 0
+        self.row_index = 0
+        # the parent merges the test files of the workers in its own order, so a worker's
+        # test file can't point to the last log of its previous test file
+        if self.part_dir is not None:
+            self.last_log = None
+
+    def init_bugs_schema(self, resume=False):
         # The basic bugs schema
         self.bugs_columns = ResultColumns
-        self.bugs_single_row = {}.fromkeys(self.bugs_columns)
-        self.bugs_dataframe = pd.DataFrame(columns=self.bugs_columns)
+        self.bugs_rows = []
 
         # The log schema
         self.logs_columns = ['LOGS']
         self.log_index = 0
-        self.logs_single_row = {}.fromkeys(self.logs_columns)
-        self.logs_dataframe = pd.DataFrame(columns=self.logs_columns)
-
-        self.bugs_dataframe.to_csv(
-            OUTPUT_PATH['execution_result'].format(self.dbms_name + self.suffix), mode="w", header=True)
-        self.logs_dataframe.to_csv(
-            OUTPUT_PATH['execution_log'].format(self.dbms_name + self.suffix), mode="w", header=True, index=False)
+        self.last_log = None
+        self.logs_rows = []
+
+        # a resumed run keeps appending to the existing csv files
+        if not self.write_files or resume or self.part_dir is not None:
+            return
+        os.makedirs(OUTPUT_PATH['base'], exist_ok=True)
+        self.write_rows(self.results_path, [[''] + self.bugs_columns], mode="w")
+        self.write_rows(self.logs_path, [self.logs_columns], mode="w")
+        self.write_rows(self.timing_path, [TimingColumns], mode="w")
+
+    def get_output_paths(self):
+        return [self.results_path, self.logs_path, self.timing_path]
+
+    def resume(self, offsets: dict, log_index: int):
+        """Go back to the state after the last finished test file of an interrupted run
+
+        Args:
+            offsets (dict): the size of each output csv after the last finished test file
+            log_index (int): the log index after the last finished test file
+        """
+        # drop the rows of the test file that was running when the run stopped
+        for path, offset in offsets.items():
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        self.log_index = log_index
 
     def get_testfile_data(self, **kwargs):
         self.testfile_path = kwargs['testfile_path']
@@ -55,39 +101,64 @@ class BugDumper():
         pass
 
     def save_state(self, logs: List[Statement], record: Record, result: str, execution_time: int, is_error=False, msg: str = ''):
-        # record the log
-        temp_log = ";\n".join([log.sql for log in logs])
-        new_log_flag = (temp_log != self.logs_single_row['LOGS'])
-
-        # print(self.bugs_single_row)
-        # print(self.logs_single_row)
-        # append to the dataframe
-        if new_log_flag and is_error:
-            self.log_index += 1
-            self.logs_single_row['LOGS'] = temp_log
-            self.logs_dataframe = pd.concat(
-                [self.logs_dataframe, pd.DataFrame([self.logs_single_row])], ignore_index=True)
-
-        # record the bug according to bugs schema
-        self.bugs_single_row['DBMS_NAME'] = self.dbms_name
-        self.bugs_single_row['TESTFILE_INDEX'] = self.testfile_index
-        self.bugs_single_row['TESTFILE_PATH'] = self.testfile_path
-        # self.bugs_single_row['ORIGINAL_SUITE'] = record.suite
-        self.bugs_single_row['TESTCASE_INDEX'] = record.id
-        self.bugs_single_row['SQL'] = record.sql
-        self.bugs_single_row['CASE_TYPE'] = type(record).__name__
-        self.bugs_single_row['EXPECTED_RESULT'] = record.result
+        begin = perf_counter_ns()
+        # record the log, only the error cases need it
+        if is_error:
+            temp_log = ";\n".join([log.sql for log in logs])
+            if temp_log != self.last_log:
+                self.log_index += 1
+                self.last_log = temp_log
+                self.logs_rows.append((temp_log, ))
+                self.buffer_size += len(temp_log)
+
+        # record the bug according to bugs schema (ResultColumns)
         # notice the result is a string
-        self.bugs_single_row['ACTUAL_RESULT'] = result.strip()
-        self.bugs_single_row['DATE'] = datetime.now().strftime(
-            "%y-%m-%d-%H:%M")
-        self.bugs_single_row['EXEC_TIME'] = execution_time
-        self.bugs_single_row['IS_ERROR'] = str(is_error)
-        self.bugs_single_row['ERROR_MSG'] = msg
-
-        self.bugs_single_row['LOGS_INDEX'] = self.log_index - 1
-        self.bugs_dataframe = pd.concat(
-            [self.bugs_dataframe, pd.DataFrame([self.bugs_single_row])], ignore_index=True)
+        actual_result = result.strip()
+        self.bugs_rows.append((self.dbms_name, self.testfile_index, self.testfile_path, None,
+                               record.id, record.sql, type(record).__name__, record.result,
+                               actual_result, execution_time, datetime.now().strftime("%y-%m-%d-%H:%M"),
+                               str(is_error), msg, self.log_index - 1, self.timer.record_times['execute'],
+                               self.timer.record_times['fetch'], self.timer.record_times['compare']))
+        self.buffer_size += len(str(record.sql)) + \
+            len(str(record.result)) + len(actual_result)
+
+        if self.write_files and (len(self.bugs_rows) >= self.BATCH_SIZE or self.buffer_size >= self.MAX_BUFFER_SIZE):
+            self.flush(self.dbms_name)
+        self.timer.add('dump', perf_counter_ns() - begin)
+
+    def get_part_paths(self, testfile_index: int):
+        """get the results and logs csv files that a --jobs worker dumps a test file to
+        """
+        return (os.path.join(self.part_dir, "%d_results.csv" % testfile_index),
+                os.path.join(self.part_dir, "%d_logs.csv" % testfile_index))
+
+    def merge_part(self, part_dir: str, testfile_index: int, log_base: int, log_num: int):
+        """Append the csv files of a single test file that a worker dumped, and remove them
+
+        The rows are streamed, so the parent process doesn't hold a whole test file in memory.
+
+        Args:
+            part_dir (str): the folder of the csv files of the workers
+            testfile_index (int): the index of the test file
+            log_base (int): the log index of the worker before it ran the test file
+            log_num (int): the number of logs the worker dumped for the test file
+        """
+        results_part = os.path.join(part_dir, "%d_results.csv" % testfile_index)
+        logs_part = os.path.join(part_dir, "%d_logs.csv" % testfile_index)
+        # LOGS_INDEX points to the rows of the logs csv, so shift it to this dumper's logs
+        logs_index = ResultColumns.index('LOGS_INDEX') + 1
+        log_shift = self.log_index - log_base
+        with open(results_part, 'r', newline='', encoding='utf-8') as src, \
+                open(self.results_path, 'a', newline='', encoding='utf-8') as dst:
+            writer = csv.writer(dst, lineterminator='\n')
+            for row in csv.reader(src):
+                row[logs_index] = int(row[logs_index]) + log_shift
+                writer.writerow(row)
+        with open(logs_part, 'rb') as src, open(self.logs_path, 'ab') as dst:
+            shutil.copyfileobj(src, dst)
+        self.log_index += log_num
+        os.remove(results_part)
+        os.remove(logs_part)
 
     def output_single_state(self, logs: List[Statement], record: Record):
         my_debug("Find a potential bug! Let's see the log and record.")
@@ -96,14 +167,46 @@ class BugDumper():
         my_debug(record.sql)
 
     def print_state(self):
-        print(self.bugs_dataframe)
-        print(self.logs_dataframe)
+        print(self.bugs_columns)
+        for row in self.bugs_rows:
+            print(row)
+        print(self.logs_columns)
+        for row in self.logs_rows:
+            print(row)
+
+    def write_rows(self, path: str, rows: list, mode='a'):
+        with open(path, mode, newline='', encoding='utf-8') as f:
+            csv.writer(f, lineterminator='\n').writerows(rows)
+
+    def flush(self, dbname: str):
+        """Append the buffered rows to the csv files and empty the buffer
+        """
+        if self.part_dir is not None:
+            results_path, logs_path = self.get_part_paths(self.testfile_index)
+        else:
+            results_path = OUTPUT_PATH['execution_result'].format(dbname + self.suffix)
+            logs_path = OUTPUT_PATH['execution_log'].format(dbname + self.suffix)
+        self.write_rows(results_path, [(i, ) + row for i, row in enumerate(self.bugs_rows, self.row_index)])
+        self.write_rows(logs_path, self.logs_rows)
+        self.row_index += len(self.bugs_rows)
+        self.bugs_rows = []
+        self.logs_rows = []
+        self.buffer_size = 0
 
     def dump_to_csv(self, dbname='demo', mode='a'):
-        my_debug("Dump the bugs as a Dataframe to a csv {}".format(dbname))
-        # if logging.getLogger().getEffectiveLevel() == logging.DEBUG:
-        #     path_suffix = "_debug"
-        self.bugs_dataframe.to_csv(
-            f"{OUTPUT_PATH['execution_result'].format(dbname + self.suffix)}", mode=mode, header=False)
-        self.logs_dataframe.to_csv(
-            f"{OUTPUT_PATH['execution_log'].format(dbname + self.suffix)}", mode=mode, header=False, index=False)
+        my_debug("Dump the bugs to a csv {}".format(dbname))
+        if mode == 'w':
+            self.write_rows(OUTPUT_PATH['execution_result'].format(dbname + self.suffix),
+                            [[''] + self.bugs_columns], mode="w")
+            self.write_rows(OUTPUT_PATH['execution_log'].format(dbname + self.suffix),
+                            [self.logs_columns], mode="w")
+            self.write_rows(OUTPUT_PATH['execution_timing'].format(dbname + self.suffix),
+                            [TimingColumns], mode="w")
+        with self.timer.phase('dump'):
+            self.flush(dbname)
+        self.timer.end_file()
+        file_times = self.timer.file_times
+        self.write_rows(OUTPUT_PATH['execution_timing'].format(dbname + self.suffix),
+                        [(self.testfile_index, self.testfile_path, file_times['parse'], file_times['connect'],
+                          file_times['execute'], file_times['fetch'], file_times['compare'],
+                          file_times['dump'], file_times['total'])])
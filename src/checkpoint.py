@@ -0,0 +1,97 @@
+import os
+import json
+import logging
+
+from .utils import OUTPUT_PATH, Running_Stats
+
+
+class Checkpoint():
+    """Keep a manifest of the finished test files of a run, so an interrupted run could resume.
+
+    The manifest is a json lines file. After a test file is dumped, one line with its index,
+    path, running stats and the sizes of the output csv files is appended and synced.
+    A line is only trusted once it is complete, and the csv files are cut back to the sizes
+    of the last trusted line before resuming, which drops the rows of a half-dumped file.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.path = OUTPUT_PATH['checkpoint'].format(name)
+        self.finished = {}
+        self.last_entry = None
+
+    def load(self):
+        """load the finished test files from the manifest
+
+        Returns:
+            bool: whether there is anything to resume
+        """
+        self.finished = {}
+        self.last_entry = None
+        try:
+            with open(self.path, 'rb') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+        # the size of the complete lines
+        size = 0
+        for line in lines:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("no line end")
+                entry = json.loads(line)
+            except ValueError:
+                # the run was killed while writing this line
+                logging.warning("Drop a broken checkpoint line: %s", line)
+                break
+            self.finished[entry['index']] = entry
+            self.last_entry = entry
+            size += len(line)
+        # cut the broken line, so the lines of the resumed run are not glued to it
+        if size < sum(len(line) for line in lines):
+            with open(self.path, 'r+b') as f:
+                f.truncate(size)
+        return self.last_entry is not None
+
+    def reset(self):
+        """start a new manifest
+        """
+        self.finished = {}
+        self.last_entry = None
+        open(self.path, 'w', encoding='utf-8').close()
+
+    def is_finished(self, index: int, test_file: str):
+        return index in self.finished and self.finished[index]['path'] == test_file
+
+    def get_stats(self):
+        """get the running stats summed over the finished test files
+        """
+        stats = {}.fromkeys(Running_Stats, 0)
+        for entry in self.finished.values():
+            for key in stats:
+                stats[key] += entry['stats'].get(key, 0)
+        return stats
+
+    def add(self, index: int, test_file: str, stats: dict, output_paths: list, log_index: int):
+        """record a dumped test file in the manifest
+
+        Args:
+            index (int): the index of the test file
+            test_file (str): the path of the test file
+            stats (dict): the single run stats of the test file
+            output_paths (list): the csv files that the test file was dumped to
+            log_index (int): the log index of the dumper after the test file
+        """
+        # the dumped rows must be on the disk before the manifest says so
+        offsets = {}
+        for path in output_paths:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+            offsets[path] = os.path.getsize(path)
+        entry = {'index': index, 'path': test_file, 'stats': stats,
+                 'offsets': offsets, 'log_index': log_index}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.finished[index] = entry
+        self.last_entry = entry
@@ -10,6 +10,7 @@ from tqdm import tqdm
 import string
 from .config import CONFIG
 from .utils import TestCaseColumns
+from .testcollector import is_parquet_corpus, read_parquet_testcases
 
 # MAXINT in SQLite is 9223372036854775807
 # from data import filters
@@ -33,16 +34,25 @@ class Fuzzer():
     def load(self, path: str) -> pd.DataFrame:
         self.test_cases = pd.read_csv(path)
         
-    def load_suite(self, path: str) -> pd.DataFrame:
-        all_test = pd.DataFrame()
+    def load_suite(self, path: str, columns: list = None, filters: dict = None) -> pd.DataFrame:
+        if is_parquet_corpus(path):
+            self.test_cases = read_parquet_testcases(path, columns=columns, filters=filters)
+            logging.debug(self.test_cases)
+            return
         test_files = []
         g = os.walk(path)
         for path, _, file_list in g:
             test_files += [os.path.join(path, file) for file in file_list]
+        all_dfs = []
         for test_file in tqdm(test_files):
             df = pd.read_csv(test_file)
             df['TESTFILE_PATH'] = test_file
-            all_test = pd.concat([all_test, df], ignore_index=True)
+            all_dfs.append(df)
+        all_test = pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()
+        for column, value in (filters or {}).items():
+            all_test = all_test[all_test[column] == value]
+        if columns is not None:
+            all_test = all_test[columns]
         self.test_cases = all_test
         logging.debug(self.test_cases)
 
@@ -181,7 +191,7 @@ class SimpleFuzzer(Fuzzer):
 
     def fuzz(self, path: str) -> None:
         random.seed(self.seed)
-        if os.path.isdir(path):
+        if os.path.isdir(path) or is_parquet_corpus(path):
             self.load_suite(path)
         else:
             self.load(path)
@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+
+import mysql.connector
+
+# the connection pools of the MySQL servers, keyed by their config
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+class ConnectionPool():
+    """Keep the idle connections of a MySQL server, so a test file doesn't open a new one.
+
+    A connection is reset when it comes back (its transaction, session variables, temporary
+    tables and so on), so the next test file starts from a fresh session as before.
+    """
+
+    def __init__(self, config: dict) -> None:
+        self.config = config
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get_connection(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                con = self.idle.pop()
+            # the server could close an idle connection
+            if con.is_connected():
+                return con
+            self.discard(con)
+        return mysql.connector.connect(**self.config)
+
+    def release(self, con):
+        """reset the connection and keep it, or discard it if it could not be reset
+        """
+        try:
+            con.consume_results()
+            con.reset_session()
+        except Exception as e:
+            logging.info("Discard the MySQL connection that could not be reset: %s", e)
+            self.discard(con)
+            return
+        with self.lock:
+            self.idle.append(con)
+
+    def discard(self, con):
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+def get_connection_pool(host: str, port: int, user: str, password: str):
+    """get the connection pool of the config, the runners with the same config share it
+    """
+    key = (host, port, user, password)
+    with POOLS_LOCK:
+        pool = POOLS.get(key)
+        if pool is None:
+            pool = POOLS[key] = ConnectionPool(
+                dict(host=host, port=port, user=user, password=password))
+        return pool
+
+
+class ScratchDatabases():
+    """A few databases that are created ahead, so a test file starts on a clean one at once.
+
+    A used database is handed to a daemon thread, which drops and creates it again on its own
+    connection while the next test files run on the other ones.
+    """
+    SIZE = 2
+    # the seconds to wait for a clean database
+    TIMEOUT = 60
+
+    def __init__(self, pool: ConnectionPool, db_name: str) -> None:
+        self.pool = pool
+        self.db_name = db_name
+        # the clean databases, with the error if one failed to be created
+        self.clean = queue.Queue()
+        self.dirty = queue.Queue()
+        for i in range(self.SIZE):
+            self.dirty.put(self.get_name(i))
+        self.thread = threading.Thread(
+            target=self.recycle_loop, name="ScratchDatabases", daemon=True)
+        self.thread.start()
+
+    def get_name(self, i: int):
+        return "%s_scratch%d" % (self.db_name, i)
+
+    def get(self):
+        """take a clean database, wait for the thread if none is ready
+
+        Returns:
+            str: the database name
+        """
+        try:
+            db_name, error = self.clean.get(timeout=self.TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError("No scratch database of %s was recreated in %d seconds" %
+                               (self.db_name, self.TIMEOUT)) from None
+        if error is not None:
+            # try it again for a later test file
+            self.recycle(db_name)
+            raise error
+        return db_name
+
+    def recycle(self, db_name: str):
+        """drop and create the used database again in the background
+        """
+        self.dirty.put(db_name)
+
+    def recycle_loop(self):
+        con = None
+        while True:
+            db_name = self.dirty.get()
+            try:
+                if con is None:
+                    con = self.pool.get_connection()
+                cur = con.cursor()
+                cur.execute("DROP DATABASE IF EXISTS %s" % db_name)
+                cur.execute("CREATE DATABASE %s" % db_name)
+                cur.close()
+                con.commit()
+            except Exception as e:
+                # keep the thread alive, the database is tried again after get() reports the error
+                logging.warning("Failed to recreate the database %s: %s", db_name, e)
+                if con is not None:
+                    self.pool.discard(con)
+                    con = None
+                self.clean.put((db_name, e))
+            else:
+                self.clean.put((db_name, None))
@@ -0,0 +1,100 @@
+import os
+import hashlib
+import logging
+import pickle
+import zlib
+from typing import List
+
+from .utils import Record, RecordBatch, OUTPUT_PATH, my_debug
+from .testparser import Parser
+
+
+def get_parse_key(parser: Parser):
+    """hash the current test file of the parser, with the parser class and version
+
+    Returns:
+        str: the key, or None if some source file could not be read
+    """
+    key = hashlib.sha1()
+    key.update(type(parser).__name__.encode('utf-8'))
+    key.update(str(parser.VERSION).encode('utf-8'))
+    for source_file in parser.get_source_files():
+        try:
+            with open(source_file, 'rb') as f:
+                content_hash = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+        key.update(source_file.encode('utf-8'))
+        key.update(content_hash.encode('utf-8'))
+    return key.hexdigest()
+
+
+class ParseCache():
+    """Cache the parsed records of the test files on disk.
+
+    An entry is keyed by the test file path, the hash of its content (and of the expected
+    result file, if the suite has one), the parser class and the parser version, so it is
+    parsed again as soon as any of them changes. The records are stored as a RecordBatch.
+    """
+
+    def __init__(self, cache_dir=OUTPUT_PATH['parse_cache']) -> None:
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, parser: Parser):
+        """get the cache key of the current test file of the parser
+
+        Returns:
+            str: the key, or None if some source file could not be read
+        """
+        return get_parse_key(parser)
+
+    def get_path(self, key: str):
+        return os.path.join(self.cache_dir, key + ".pkl.z")
+
+    def load(self, key: str):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Broken parse cache entry %s: %s", key, e)
+            return None
+
+    def store(self, key: str, records: List[Record]):
+        path = self.get_path(key)
+        # write to a temp file first, so that a concurrent reader never sees half of an entry
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(
+                RecordBatch(records), protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp_path, path)
+
+    def parse(self, parser: Parser, test_file: str):
+        """parse the test file with the parser, or load its records from the cache
+
+        Args:
+            parser (Parser): the parser of the test suite
+            test_file (str): the path of the test file
+
+        Returns:
+            Iterable[Record]: the records of the test file, a RecordBatch if they are loaded from the cache
+        """
+        parser.get_file_name(test_file)
+        key = self.get_key(parser)
+        records = self.load(key) if key else None
+        if records is not None:
+            my_debug("load %s from the parse cache", test_file)
+            self.hits += 1
+            parser.records = records
+            return records
+        self.misses += 1
+        parser.get_file_content()
+        parser.parse_file()
+        records = parser.get_records()
+        if key:
+            self.store(key, records)
+        return records
@@ -0,0 +1,146 @@
+import logging
+import re
+
+from .utils import Statement
+
+# the statements that could be shared, they only build the tables and their rows
+PREFIX_STATEMENT_REGEX = re.compile(
+    r'^\s*(CREATE\s+(TABLE|VIEW|INDEX|UNIQUE\s+INDEX)|INSERT)\b', re.IGNORECASE)
+
+
+class PrefixNode():
+    def __init__(self, parent, sql: str, depth: int) -> None:
+        self.parent = parent
+        self.sql = sql
+        self.depth = depth
+        self.children = {}
+        self.file_num = 0
+        # the id of the snapshot at this node, if any file snapshots here
+        self.snapshot_id = None
+
+
+class PrefixSnapshots():
+    """Run the statements that several test files start with once, and restore them from a snapshot.
+
+    Before the run, the leading CREATE/INSERT statements of the test files are put into a trie.
+    Each test file snapshots at the deepest node it shares with another file. The snapshot is
+    built the first time a file needs it, from the closest snapshot above it, and the files
+    restore it instead of executing the shared statements (e.g. SQLite backup, DuckDB file copy,
+    PostgreSQL template database).
+    """
+    MIN_SHARED_STATEMENTS = 2
+
+    def __init__(self, dbms_name: str) -> None:
+        self.dbms_name = dbms_name
+        self.root = PrefixNode(None, "", 0)
+        self.file_prefix = {}
+        # snapshot id -> the statements from the parent snapshot, the parent snapshot id and the depth
+        self.snapshots = {}
+        self.file_snapshot = {}
+        self.runner = None
+        self.db_name = ""
+        self.built = {}
+
+    def get_prefix(self, records: list):
+        """get the leading statements that could be shared
+        """
+        prefix = []
+        for record in records:
+            if type(record) is not Statement or not record.status or self.dbms_name not in record.db \
+                    or not PREFIX_STATEMENT_REGEX.match(record.sql):
+                break
+            prefix.append(record.sql)
+        return prefix
+
+    def add_file(self, test_file: str, records: list):
+        node = self.root
+        for sql in self.get_prefix(records):
+            child = node.children.get(sql)
+            if child is None:
+                child = node.children[sql] = PrefixNode(node, sql, node.depth + 1)
+            child.file_num += 1
+            node = child
+        self.file_prefix[test_file] = node
+
+    def plan(self):
+        """pick the snapshot of each test file, after all the files are added
+        """
+        for test_file, node in self.file_prefix.items():
+            while node.depth >= self.MIN_SHARED_STATEMENTS and node.file_num < 2:
+                node = node.parent
+            if node.depth < self.MIN_SHARED_STATEMENTS:
+                continue
+            if node.snapshot_id is None:
+                node.snapshot_id = len(self.snapshots)
+                self.snapshots[node.snapshot_id] = node
+            self.file_snapshot[test_file] = node.snapshot_id
+        for snapshot_id, node in list(self.snapshots.items()):
+            statements = []
+            parent = node
+            while True:
+                statements.append(parent.sql)
+                parent = parent.parent
+                if parent.snapshot_id is not None or parent is self.root:
+                    break
+            statements.reverse()
+            self.snapshots[snapshot_id] = (statements, parent.snapshot_id, node.depth)
+        # the trie is no more needed, and the plan is sent to the --jobs workers
+        self.root = None
+        self.file_prefix = {}
+        logging.info("%d test files share %d prefix snapshots",
+                     len(self.file_snapshot), len(self.snapshots))
+
+    def bind(self, runner, db_name: str):
+        """set the runner and the database name that the snapshots are built by
+        """
+        self.runner = runner
+        self.db_name = db_name
+        self.built = {}
+
+    def get_snapshot(self, snapshot_id: int):
+        """get the name of the snapshot, build it if it is not built yet
+
+        Returns:
+            str: the snapshot name, or None if it failed to build
+        """
+        if snapshot_id in self.built:
+            return self.built[snapshot_id]
+        statements, parent_id, _ = self.snapshots[snapshot_id]
+        parent = None
+        if parent_id is not None:
+            parent = self.get_snapshot(parent_id)
+            if parent is None:
+                self.built[snapshot_id] = None
+                return None
+        snapshot = self.get_name(self.db_name, snapshot_id)
+        try:
+            self.runner.build_snapshot(snapshot, parent, statements)
+        except (self.runner.db_error, NotImplementedError) as e:
+            logging.warning("Failed to build the prefix snapshot %s: %s", snapshot, e)
+            snapshot = None
+        self.built[snapshot_id] = snapshot
+        return snapshot
+
+    def get(self, test_file: str):
+        """get the snapshot that the test file could restore
+
+        Returns:
+            Tuple[str, int]: the snapshot name and the number of the leading statements it holds,
+                or (None, 0) if the test file doesn't share its prefix
+        """
+        snapshot_id = self.file_snapshot.get(test_file)
+        if snapshot_id is None:
+            return None, 0
+        snapshot = self.get_snapshot(snapshot_id)
+        if snapshot is None:
+            return None, 0
+        return snapshot, self.snapshots[snapshot_id][2]
+
+    def get_name(self, db_name: str, snapshot_id: int):
+        return "%s_prefix%d" % (db_name, snapshot_id)
+
+    def drop_all(self, runner, db_name: str):
+        """drop the snapshots that could be built for the database name
+        """
+        for snapshot_id in self.snapshots:
+            runner.drop_snapshot(self.get_name(db_name, snapshot_id))
@@ -0,0 +1,94 @@
+import logging
+import re
+import subprocess
+import uuid
+from typing import List
+
+from .utils import DBEngineExcetion
+
+# psql prefixes the messages of the commands it reads from stdin with their location
+LOCATION_REGEX = re.compile(r"^psql:<stdin>:\d+: ", re.MULTILINE)
+# a meta-command takes the rest of its line, the backslashes in the strings don't count
+STRING_REGEX = re.compile(r"'(?:[^']|'')*'")
+META_COMMAND_REGEX = re.compile(r"\\[a-zA-Z!?]")
+ERROR_REGEX = re.compile(r"^(ERROR|FATAL):", re.MULTILINE)
+
+
+def ends_with_meta_command(sql: str):
+    """whether the last line of the command has a meta-command (e.g. SELECT ... \\gset),
+    which sends the statement before it
+    """
+    last_line = sql[sql.rfind('\n') + 1:]
+    return META_COMMAND_REGEX.search(STRING_REGEX.sub('', last_line)) is not None
+
+
+def has_error(output: str):
+    """whether the output of a command has an error message
+    """
+    return ERROR_REGEX.search(output) is not None
+
+
+class PSQLCoprocess():
+    """A long-lived psql process that runs single commands on one connection.
+
+    Each command is followed by an \\echo of a delimiter line, and the output (stdout and
+    stderr together) is read line by line until the delimiter, so the process and its
+    connection are kept for the next command instead of starting psql for every one.
+    """
+
+    def __init__(self, cmd: List[str]) -> None:
+        """
+        Args:
+            cmd (List[str]): the psql command line, without -c
+        """
+        self.cmd = cmd
+        # psql -a echoes the input lines before their output
+        self.echo_all = '-a' in cmd or '--echo-all' in cmd
+        self.delimiter = "*--%s--*" % uuid.uuid4().hex
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, encoding='utf-8')
+
+    def execute(self, sql: str):
+        """run a command and read its output
+
+        Returns:
+            str: the output, with the messages in the same form as psql -c prints them
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            self.start()
+        sql = sql.strip()
+        # a meta-command after an unterminated statement would run before it
+        if not sql.endswith(';') and not ends_with_meta_command(sql):
+            sql += ';'
+        lines = []
+        try:
+            self.proc.stdin.write("%s\n\\echo %s\n" % (sql, self.delimiter))
+            self.proc.stdin.flush()
+            for line in self.proc.stdout:
+                if line.rstrip('\n') == self.delimiter:
+                    if self.echo_all:
+                        # drop the echoed command and the echoed \echo of the delimiter
+                        lines = lines[sql.count('\n') + 1:-1]
+                    return LOCATION_REGEX.sub('', ''.join(lines))
+                lines.append(line)
+        except OSError as e:
+            lines.append(str(e))
+        # psql exits once it loses the connection, it is started again for the next command
+        self.close()
+        raise DBEngineExcetion("psql exited: %s" % ''.join(lines))
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            logging.info("psql didn't exit, kill it")
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+        self.proc = None
@@ -0,0 +1,176 @@
+import re
+
+# the runs of characters that don't change the state of the splitter are skipped at once
+SKIP_PATTERN = r"""\s+|--[^\n]*|"(?:[^"]|"")*"|[^\s\w;()'"$\\/-]+|\d+|/(?!\*)|-"""
+TOKEN_PATTERN = r"""
+    (?P<skip>(?:%s)+)
+  | (?P<block_comment>/\*)
+  | (?P<estring>[eE]')
+  | (?P<string>')
+  | (?P<quote>")
+  | (?P<dollar>\$(?:[^\W\d]\w*)?\$)
+  | (?P<word>[^\W\d][\w$]*)
+  | (?P<semicolon>;)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<backslash>\\)
+  | (?P<other>.)
+"""
+TOKEN_REGEX = re.compile(TOKEN_PATTERN % SKIP_PATTERN, re.VERBOSE | re.DOTALL)
+# once the statement is known not to be a CREATE FUNCTION, its words are skipped as well
+TOKEN_SKIP_WORD_REGEX = re.compile(TOKEN_PATTERN % (
+    SKIP_PATTERN + r"""|(?![eE]')[^\W\d][\w$]*"""), re.VERBOSE | re.DOTALL)
+STRING_END_REGEX = re.compile(r"[^']*(?:''[^']*)*'")
+ESTRING_END_REGEX = re.compile(r"(?:[^'\\]+|\\.|'')*'", re.DOTALL)
+BLOCK_COMMENT_REGEX = re.compile(r"/\*|\*/")
+# the spaces and the line comment after a command on its line belong to it, so do the comment lines right after
+TRAILING_REGEX = re.compile(r"(?:[^\S\r\n]+|--[^\r\n]*(?:\r\n|\r|\n|$))*")
+META_NAME_REGEX = re.compile(r"[^\s\\]*")
+COPY_STDIN_REGEX = re.compile(r"\bfrom\s+stdin\b", re.IGNORECASE)
+COPY_DATA_END_REGEX = re.compile(r"^\\\.$", re.MULTILINE)
+# the words that begin CREATE [OR REPLACE] FUNCTION|PROCEDURE, whose BEGIN ATOMIC ... END body holds semicolons
+CREATE_FUNCTION_WORDS = {'create', 'or', 'replace', 'function', 'procedure'}
+CREATE_FUNCTION_PREFIXES = ('cf', 'cp', 'corf', 'corp')
+
+
+class SplitError(ValueError):
+    """The script ends in the middle of a string, a comment, a statement or a COPY data block"""
+
+
+def split_psql_script(content: str):
+    """split a psql script into commands in one pass, like psql reads it
+
+    A command is a SQL statement with its terminating semicolon, a backslash meta-command
+    (with a semicolon appended), the data lines of a COPY FROM stdin ending with `\\.;`, or a
+    whole \\if ... \\endif block. The whitespaces and the line comments after a command belong
+    to it, and each command is stripped.
+
+    Returns:
+        List[str]: the commands
+    """
+    commands = []
+    # the commands of the \if block that is not closed yet
+    block = []
+    if_depth = 0
+
+    def add(command: str, meta: str = ''):
+        nonlocal if_depth
+        if meta == 'if':
+            if_depth += 1
+        if not if_depth:
+            commands.append(command + ';' if meta else command)
+            return
+        block.append(command)
+        if meta == 'endif':
+            if_depth -= 1
+            if not if_depth:
+                commands.append('\n'.join(block))
+                block.clear()
+
+    def add_copy_data(pos: int):
+        """add the data lines after the COPY FROM stdin to the \\. line, and return the position after them
+        """
+        m = COPY_DATA_END_REGEX.search(content, pos)
+        if m is None:
+            raise SplitError("the COPY data is not ended by \\.")
+        add(content[pos:m.end()].strip(), '.')
+        return TRAILING_REGEX.match(content, m.end()).end()
+
+    size = len(content)
+    start = pos = 0
+    paren_depth = begin_depth = word_num = 0
+    first_word = initials = ''
+    while pos < size:
+        m = (TOKEN_REGEX if word_num < 4 or initials.startswith(CREATE_FUNCTION_PREFIXES)
+             else TOKEN_SKIP_WORD_REGEX).match(content, pos)
+        kind = m.lastgroup
+        pos = m.end()
+        if kind == 'skip' or kind == 'other':
+            continue
+        elif kind == 'word':
+            word = m.group().lower()
+            if word_num == 0:
+                first_word = word
+            if word_num < 4:
+                initials += word[0] if word in CREATE_FUNCTION_WORDS else '_'
+            word_num += 1
+            if paren_depth == 0 and initials.startswith(CREATE_FUNCTION_PREFIXES):
+                if word == 'begin':
+                    begin_depth += 1
+                elif word == 'case':
+                    # CASE also ends with END, it only matters inside a BEGIN
+                    if begin_depth:
+                        begin_depth += 1
+                elif word == 'end' and begin_depth:
+                    begin_depth -= 1
+        elif kind == 'string' or kind == 'estring':
+            end_regex = STRING_END_REGEX if kind == 'string' else ESTRING_END_REGEX
+            m = end_regex.match(content, pos)
+            if m is None:
+                raise SplitError("unterminated string at %d" % pos)
+            pos = m.end()
+        elif kind == 'quote':
+            raise SplitError("unterminated quoted identifier at %d" % pos)
+        elif kind == 'dollar':
+            end = content.find(m.group(), pos)
+            if end < 0:
+                raise SplitError("unterminated dollar quote %s at %d" % (m.group(), pos))
+            pos = end + len(m.group())
+        elif kind == 'block_comment':
+            # the block comments could be nested
+            depth = 1
+            while depth:
+                m = BLOCK_COMMENT_REGEX.search(content, pos)
+                if m is None:
+                    raise SplitError("unterminated comment at %d" % pos)
+                depth += 1 if m.group() == '/*' else -1
+                pos = m.end()
+        elif kind == 'open':
+            paren_depth += 1
+        elif kind == 'close':
+            if paren_depth:
+                paren_depth -= 1
+        elif kind == 'semicolon' or kind == 'backslash':
+            meta = ''
+            if kind == 'semicolon':
+                if paren_depth or begin_depth:
+                    continue
+                end = pos
+                is_copy = first_word == 'copy'
+            else:
+                # \; is a semicolon that does not end the statement
+                if content.startswith(';', pos) or content.startswith('\\', pos):
+                    pos += 1
+                    continue
+                # the meta-command takes the rest of the line
+                meta = META_NAME_REGEX.match(content, pos).group()
+                end = content.find('\n', pos)
+                end = size if end < 0 else end
+                line_begin = max(content.rfind('\n', 0, pos - 1) + 1, start)
+                is_copy = meta == 'copy'
+            if meta:
+                add((content[start:line_begin] + content[line_begin:end].strip('; \n')).strip(), meta)
+            else:
+                # the line comments after the statement belong to it, but not the COPY data
+                trailing_end = TRAILING_REGEX.match(content, end).end()
+                line_end = content.find('\n', end)
+                if is_copy and 0 <= line_end < trailing_end:
+                    trailing_end = line_end
+                add(content[start:trailing_end].strip())
+                end = trailing_end
+            if is_copy and COPY_STDIN_REGEX.search(content, start, end):
+                data_begin = content.find('\n', end)
+                pos = add_copy_data(size if data_begin < 0 else data_begin + 1)
+            else:
+                pos = TRAILING_REGEX.match(content, end).end()
+            start = pos
+            paren_depth = begin_depth = word_num = 0
+            first_word = initials = ''
+    if paren_depth or begin_depth:
+        raise SplitError("unbalanced parentheses or BEGIN ... END at the end")
+    rest = content[start:].strip()
+    if rest:
+        add(rest)
+    if block:
+        commands.append('\n'.join(block))
+    return commands
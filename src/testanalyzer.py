@@ -8,7 +8,8 @@ from sqlparse.tokens import Keyword
 import pandas as pd
 from tqdm import tqdm
 from copy import copy
-from .utils import TestCaseColumns, ResultColumns, OUTPUT_PATH, convert_testfile_name, DBMS_MAPPING
+from .utils import TestCaseColumns, ResultColumns, OUTPUT_PATH, convert_testfile_name, DBMS_MAPPING, read_results_csv
+from .testcollector import is_parquet_corpus, read_parquet_testcases
 
 
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -45,7 +46,23 @@ class TestCaseAnalyzer():
             df = pd.DataFrame(columns=TestCaseColumns)
         return df
 
-    def load_testcases(self, dir_name: str = "", file_name: str = ""):
+    def load_testcases(self, dir_name: str = "", file_name: str = "", columns: list = None, filters: dict = None):
+        """load the test cases of a test file, or of all the test files in a directory
+
+        Args:
+            dir_name (str, optional): the directory of the extracted test files. Defaults to "".
+            file_name (str, optional): the extracted test file. Defaults to "".
+            columns (list, optional): only load these columns. Defaults to all.
+            filters (dict, optional): only load the test cases whose column equals the value,
+                e.g. {'TYPE': 'QUERY'}. Defaults to None.
+        """
+        path = file_name or dir_name
+        if path != "" and is_parquet_corpus(path):
+            # one scan over the parquet corpus, the columns and the filters are pushed down
+            self.test_cases = read_parquet_testcases(
+                path, columns=columns, filters=filters, as_text=True)
+            self.test_num = len(self.test_cases)
+            return
         if file_name != "":
             self.test_cases = self.read_testcase(file_name)
         elif dir_name != "":
@@ -69,6 +86,10 @@ class TestCaseAnalyzer():
         else:
             logging.warning("dir_name and file_name could not be both empty!")
             self.test_cases = pd.DataFrame(columns=TestCaseColumns)
+        for column, value in (filters or {}).items():
+            self.test_cases = self.test_cases[self.test_cases[column] == str(value)]
+        if columns is not None:
+            self.test_cases = self.test_cases[columns]
         self.test_num = len(self.test_cases)
 
     def extract_subset(self, test_case_index: list):
@@ -221,7 +242,7 @@ class TestResultAnalyzer():
             self.results_path = OUTPUT_PATH['execution_result'].format(
                 dbms + suffix)
             logs_path = OUTPUT_PATH['execution_log'].format(dbms + suffix)
-        self.results = pd.read_csv(self.results_path, na_filter=False)
+        self.results = read_results_csv(self.results_path)
         self.logs = pd.read_csv(logs_path, na_filter=False)
         self.result_num = len(self.results)
 
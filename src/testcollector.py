@@ -1,11 +1,23 @@
 import os
 import sys
 import re
+import glob
+import duckdb
 import pandas as pd
 from typing import List
 
 from .utils import Control, Query, Record, Statement, TestCaseColumns, OUTPUT_PATH
 
+PARQUET_SUFFIX = ".parquet"
+# the types of the test case columns in the parquet corpus, the others are VARCHAR
+TestCaseTypes = {
+    'INDEX': 'BIGINT',
+    'STATUS': 'BOOLEAN',
+    'SORT_TYPE': 'INTEGER',
+    'RES_FORM': 'INTEGER',
+    'IS_HASH': 'BOOLEAN',
+}
+
 
 class TestcaseCollector():
     def __init__(self, base_path=OUTPUT_PATH['testcase_dir']) -> None:
@@ -15,12 +27,25 @@ class TestcaseCollector():
         self.record_row = {}.fromkeys(self.columns)
         self.base_path = base_path
         self.output_path = base_path + "demo.zip"
-
-    def init_testcase_schema(self, testsuite_name: str, testcase_name: str, compression: bool = True):
+        self.file_format = 'csv'
+
+    def init_testcase_schema(self, testsuite_name: str, testcase_name: str, compression: bool = True,
+                             file_format: str = 'csv'):
+        """set the output path of the test file
+
+        Args:
+            testsuite_name (str): the name of the test suite
+            testcase_name (str): the name of the test file
+            compression (bool, optional): whether to zip the csv file. Defaults to True.
+            file_format (str, optional): csv, or parquet for the columnar corpus. Defaults to 'csv'.
+        """
         self.testcase_name = testcase_name
+        self.file_format = file_format
         self.output_path = "{}{}/{}".format(
             self.base_path, testsuite_name, testcase_name)
-        if compression:
+        if file_format == 'parquet':
+            self.output_path = re.sub(r'\.csv$', '', self.output_path) + PARQUET_SUFFIX
+        elif compression:
             self.output_path += ".zip"
 
     def save_records(self, records: List[Record]):
@@ -51,9 +76,82 @@ class TestcaseCollector():
             tmp_list.append(self.record_row)
         self.testcase_df = pd.DataFrame(tmp_list, columns=self.columns)
 
+    def dump(self):
+        if self.file_format == 'parquet':
+            self.dump_to_parquet()
+        else:
+            self.dump_to_csv()
+
     def dump_to_csv(self):
         self.testcase_df.to_csv(self.output_path, mode='w', header=True)
 
+    def dump_to_parquet(self):
+        """dump the test cases to a parquet file, with the typed columns of TestCaseTypes
+        """
+        select_list = ', '.join('CAST("{0}" AS {1}) AS "{0}"'.format(column, TestCaseTypes.get(column, 'VARCHAR'))
+                                for column in self.columns)
+        con = duckdb.connect()
+        try:
+            con.register('testcases', self.testcase_df)
+            con.execute("COPY (SELECT {} FROM testcases) TO '{}' (FORMAT PARQUET, COMPRESSION ZSTD)".format(
+                select_list, self.output_path.replace("'", "''")))
+        finally:
+            con.close()
+
+
+def is_parquet_corpus(path: str):
+    """whether the path is a parquet test file, or a directory of them
+    """
+    if os.path.isdir(path):
+        return len(glob.glob(os.path.join(path, '**', '*' + PARQUET_SUFFIX), recursive=True)) > 0
+    return path.endswith(PARQUET_SUFFIX)
+
+
+def read_parquet_testcases(path: str, columns: List[str] = None, filters: dict = None, as_text: bool = False):
+    """read the test cases of a parquet file, or of all the parquet files under a directory, in one scan
+
+    Only the selected columns are read, and the filters are pushed down to the parquet reader, so the
+    row groups that can't match them are skipped. A TESTFILE_PATH filter only opens that file.
+
+    Args:
+        path (str): a parquet file or a directory of them
+        columns (List[str], optional): the columns to read, TESTFILE_PATH is the file of the test case. Defaults to all.
+        filters (dict, optional): the column -> value that the test cases equal, e.g. {'TYPE': 'QUERY'}. Defaults to None.
+        as_text (bool, optional): read every column as text like the csv files, with '' for the missing values. Defaults to False.
+
+    Returns:
+        pd.DataFrame: the test cases
+    """
+    filters = dict(filters or {})
+    if 'TESTFILE_PATH' in filters:
+        source = filters.pop('TESTFILE_PATH')
+    elif os.path.isdir(path):
+        source = os.path.join(path, '**', '*' + PARQUET_SUFFIX)
+    else:
+        source = path
+    if columns is None:
+        columns = TestCaseColumns + ['TESTFILE_PATH']
+
+    select_list = []
+    for column in columns:
+        expr = 'filename' if column == 'TESTFILE_PATH' else '"%s"' % column
+        if as_text:
+            if TestCaseTypes.get(column) == 'BOOLEAN':
+                expr = "CASE WHEN {0} THEN 'True' WHEN NOT {0} THEN 'False' END".format(expr)
+            expr = "COALESCE(CAST({} AS VARCHAR), '')".format(expr)
+        select_list.append('%s AS "%s"' % (expr, column))
+    where = ' AND '.join('%s = ?' % ('filename' if column == 'TESTFILE_PATH' else '"%s"' % column)
+                         for column in filters)
+    sql = "SELECT {} FROM read_parquet('{}', filename=true)".format(
+        ', '.join(select_list), source.replace("'", "''"))
+    if where:
+        sql += " WHERE " + where
+    con = duckdb.connect()
+    try:
+        return con.execute(sql, list(filters.values())).df()
+    finally:
+        con.close()
+
 
 def find_local_tests(db_name: str):
     db_name = db_name.lower()
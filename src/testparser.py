@@ -1,12 +1,33 @@
 import re
 import difflib
+from bisect import bisect_left
 import sqlparse
 from copy import copy
+import codecs
+from itertools import chain
+import duckdb
 import pandas as pd
 from .utils import *
+from .testcollector import is_parquet_corpus, read_parquet_testcases
+from .psqlsplitter import SplitError, split_psql_script
 from typing import List
 
 
+def decode_as_windows_1252(error: UnicodeDecodeError):
+    return error.object[error.start:error.end].decode('windows-1252'), error.end
+
+
+codecs.register_error('squality.windows-1252', decode_as_windows_1252)
+
+
+def open_test_file(filename: str):
+    """open a test file as UTF-8, and take the bytes that are not UTF-8 as windows-1252
+
+    The streaming and the eager readers decode a file with mixed encodings the same way.
+    """
+    return open(filename, 'r', encoding='utf-8', errors='squality.windows-1252')
+
+
 def strip_hash_comment_lines(code: str):
     return re.sub(r'(?m)^ *#.*\n?', '', code)
 
@@ -20,6 +41,9 @@ def strip_comment_suffix(code: str):
 
 
 class Parser:
+    # bump it when the parsing logic changes, so that the cached records are parsed again
+    VERSION = 6
+
     def __init__(self, filename='') -> None:
         self.filename: str = filename
         self.test_content = ""
@@ -34,24 +58,18 @@ class Parser:
         """
 
     def _read_file(self, filename):
-        content = ""
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            with open(filename, 'r', encoding='windows-1252') as f:
-                content = f.read()
-        return content
+        with open_test_file(filename) as f:
+            return f.read()
 
     def _read_file_lines(self, filename):
-        content = ""
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.readlines()
-        except UnicodeDecodeError:
-            with open(filename, 'r', encoding='windows-1252') as f:
-                content = f.readlines()
-        return content
+        with open_test_file(filename) as f:
+            return f.readlines()
+
+    def _iter_file_lines(self, filename):
+        """read the lines of the file one by one, without loading the whole file
+        """
+        with open_test_file(filename) as f:
+            yield from f
 
     def read_file(self, filename, byline=False):
         if byline:
@@ -65,9 +83,23 @@ class Parser:
     def get_file_content(self):
         self.test_content = self._read_file(self.filename)
 
+    def get_source_files(self):
+        """get the files that the records of the current test file are parsed from
+        """
+        return [self.filename]
+
     def parse_file(self):
         pass
 
+    def iter_records(self):
+        """parse the records of the file and yield them one by one
+
+        The parsers that could not parse a file incrementally parse the whole file first.
+        """
+        self.get_file_content()
+        self.parse_file()
+        yield from self.records
+
     def testfile_dialect_handler(self, *args, **kwargs):
         return Control(action=RunnerAction.HALT, id=self.record_id)
 
@@ -102,9 +134,12 @@ class CSVParser(Parser):
 
     def get_file_content(self):
         try:
-            self.test_content = pd.read_csv(
-                self.filename, compression=self.compression, na_filter=False).fillna('')
-        except FileNotFoundError:
+            if is_parquet_corpus(self.filename):
+                self.test_content = read_parquet_testcases(self.filename, columns=TestCaseColumns)
+            else:
+                self.test_content = pd.read_csv(
+                    self.filename, compression=self.compression, na_filter=False).fillna('')
+        except (FileNotFoundError, duckdb.IOException):
             self.test_content = pd.DataFrame([])
             logging.warning("Test file not find or not in the correct form!")
 
@@ -116,7 +151,7 @@ class CSVParser(Parser):
                                    id=row.INDEX, result=str(row.RESULT))
             elif row.TYPE == "QUERY":
                 record = Query(sql=row.SQL, result=row.RESULT, data_type=row.DATA_TYPE, sort=SortType(
-                    int(row.SORT_TYPE)), id=row.INDEX, label=row.LABEL)
+                    int(row.SORT_TYPE)), id=row.INDEX, label=row.get('LABEL', ''))
             elif row.TYPE == "CONTROL":
                 record = Control(action=RunnerAction(int(row.SQL)))
             record.set_execute_db(row.DBMS.split(','))
@@ -131,7 +166,7 @@ class SLTParser(Parser):
     def __init__(self, filename='') -> None:
         super().__init__(filename)
         self.scripts = []
-        self.dbms_set = DBMS_Set
+        self.dbms_set = ALL_DBMS
 
     def get_query(self, tokens, lines):
         # A query record begins with a line of the following form:
@@ -195,9 +230,7 @@ class SLTParser(Parser):
 
         elif record_type == 'skipif':
             if tokens[1] in self.dbms_set:
-                self.dbms_set.remove(tokens[1])
-            else:
-                pass
+                self.dbms_set = self.dbms_set - {tokens[1]}
             record = self._parse_script_lines(lines[1:])
             if record:
                 record.set_execute_db(self.dbms_set)
@@ -234,23 +267,48 @@ class SLTParser(Parser):
         # Lines of the test script that begin with the sharp
         # character ("#", ASCII code 35) are comment lines and are ignored
         lines = [line for line in script.split('\n') if line[0] != '#']
-        self.dbms_set = copy(DBMS_Set)
+        self.dbms_set = ALL_DBMS
         r = self._parse_script_lines(lines)
         if r:
             self.records.append(r)
 
     # Each record is separated from its neighbors by one or more blank line.
 
+    def iter_scripts(self, lines):
+        """group the lines into scripts by the blank lines
+        """
+        script = []
+        # the end of the file ends the last script
+        for line in chain(lines, ['']):
+            line = line.rstrip('\n')
+            if line:
+                script.append(line)
+                continue
+            script = '\n'.join(script).strip()
+            if script:
+                yield script
+            script = []
+
     def parse_file(self):
         """ parse the file by double \\n into a list\n. Then call parse_script() 
         """
-        self.scripts = [script.strip()
-                        for script in self.test_content.strip().split('\n\n') if script != '']
+        self.scripts = list(self.iter_scripts(self.test_content.split('\n')))
         # print(self.scripts)
         self.records = []
         self.record_id = 0
         for _, script in enumerate(self.scripts):
-            self.parse_script(script.strip())
+            self.parse_script(script)
+
+    def iter_records(self):
+        """read the file incrementally and yield the records once their script is parsed
+        """
+        self.records = []
+        self.record_id = 0
+        for script in self.iter_scripts(self._iter_file_lines(self.filename)):
+            self.parse_script(script)
+            if self.records:
+                yield from self.records
+                self.records = []
 
     # TODO Should implement a fucntion to find the location of the error
     def print_scripts(self):
@@ -286,14 +344,22 @@ class MYTParser(Parser):
         self.test_content = self._read_file(self.testfile)
         self.result_content = self._read_file(self.resultfile)
 
-    def find_next_command(self, id):
-        if id + 1 >= len(self.records):
-            return ""
-        command = self.records[id + 1].sql
-        if command != "":
-            return command.split('\n')[0]
-        else:
-            return self.find_next_command(id + 1)
+    def get_source_files(self):
+        return [self.testfile, self.resultfile]
+
+    def get_next_commands(self):
+        """get the first line of the next record with SQL for each record, in one backward pass
+
+        Returns:
+            List[str]: the next command of each record, "" for the last ones
+        """
+        next_commands = [""] * len(self.records)
+        next_command = ""
+        for i in range(len(self.records) - 1, -1, -1):
+            next_commands[i] = next_command
+            if self.records[i].sql != "":
+                next_command = self.records[i].sql.split('\n')[0]
+        return next_commands
 
     def get_test_commands(self):
         record_id = 0
@@ -316,18 +382,22 @@ class MYTParser(Parser):
                     record_id += 1
 
     def get_test_results(self):
+        # a cursor over the result file, instead of slicing off the matched part after each command
+        content = self.result_content
+        size = len(content)
+        pos = 0
+        next_commands = self.get_next_commands()
         for i, record in enumerate(self.records):
             if type(record) is Record:
                 command = record.sql.split('\n')[-1]
                 assert i == record.id
-                # print(record.id, len(self.records))
-                next_command = self.find_next_command(record.id)
-                loc = self.result_content.find(command) + len(command) + 1
-                self.result_content = self.result_content[loc:]
-                next_loc = self.result_content.find(
-                    next_command) if next_command != "" else 0
-                if next_loc > 0:
-                    result = self.result_content[:next_loc]
+                next_command = next_commands[i]
+                found = content.find(command, pos)
+                # skip the command and the new line after it, or as many characters if it is not found
+                pos = min(size, (found if found >= 0 else pos - 1) + len(command) + 1)
+                next_loc = content.find(next_command, pos) if next_command != "" else pos
+                if next_loc > pos:
+                    result = content[pos:next_loc]
                 else:
                     result = ""
                 record.result = result
@@ -375,6 +445,9 @@ class PGTParser(Parser):
         self.result_content = re.sub(
             r"; {1,2}--.*?$", ";", self.result_content, flags=re.MULTILINE)
 
+    def get_source_files(self):
+        return [self.testfile, self.resultfile]
+
     def testfile_dialect_handler(self, *args, **kwargs):
 
         return super().testfile_dialect_handler(*args, **kwargs)
@@ -394,24 +467,14 @@ class PGTParser(Parser):
             keepends=True) if line != '\n']
 
     def split_file(self):
-        test_content = self.test_content
+        try:
+            return split_psql_script(self.test_content)
+        except SplitError as e:
+            # the script may not be valid, let sqlparse split it as well as it could
+            logging.warning("Fall back to sqlparse to split %s: %s", self.testfile, e)
         test_content = ''.join([line if not line.startswith(
             '\\') and not line.endswith('\\gset\n') else line.strip('; \n') + ';\n' for line in self.test_content.splitlines(keepends=True)])
-        commands = sqlparse.split(test_content)
-        # currently do a hack here
-        if self.testfile.endswith('gin.sql'):
-            commands = commands[:-1] + [command.strip(
-                ';\n') + ';\n' for command in commands[-1].split(';\n')]
-
-        # we need to do a special handling for the case that we have \if \endif psql commands
-        for i in range(0, len(commands)):
-            if commands[i] == "\\endif;":
-                commands[i - 2] = "".join(commands[i - 2: i + 1]
-                                          ).replace(';', '\n')
-                commands.pop(i - 1)
-                commands.pop(i - 1)
-                break
-        return commands
+        return sqlparse.split(test_content)
 
     def parse_file_by_split(self):
         commands = self.split_file()
@@ -424,26 +487,31 @@ class PGTParser(Parser):
 
         result_lines = [
             line for line in self.result_content.splitlines() if line != '']
+        stripped_lines = [line.strip(';') for line in result_lines]
+        # the positions of each line in the result file, to find the output of the next command
+        line_positions = {}
+        for j, line in enumerate(stripped_lines):
+            line_positions.setdefault(line, []).append(j)
 
-        # Compare with the commands parsed by sqlparse
-        # split the diff according to the line number
-        ind = 0
+        # the first line of the next command, the input data (e.g. of COPY FROM stdin) is skipped
         num_command = len(commands)
+        next_lines = [''] * num_command
+        next_line = ''
+        for i in range(num_command - 1, -1, -1):
+            next_lines[i] = next_line
+            if not commands[i].endswith('\\.;'):
+                next_line = commands[i].splitlines()[0].strip(';')
+
+        # walk the commands and their echo in the result file together
+        ind = 0
         num_input = 0
         psql_flag = False
         for i, command in enumerate(commands):
             result = ""
-            command_lines = [line.strip(';') for line in command.splitlines()]
-            # if next command is actually a input, skip this one
-            for k in range(i, num_command):
-                next_command = commands[k + 1] if k < num_command - 1 else "\n"
-                if not next_command.endswith('\\.;'):
-                    break
-            next_line = next_command.splitlines()[0].strip(
-                ';') if next_command != ';' else ''
-
-            if command_lines[0] == result_lines[ind].strip(';'):
-                ind += len(command.split('\n'))
+            next_line = next_lines[i]
+
+            if command.splitlines()[0].strip(';') == stripped_lines[ind]:
+                ind += command.count('\n') + 1
             # skip the input command
             else:
                 self.records[i - 1 - num_input].input_data = command.strip(';')
@@ -453,22 +521,23 @@ class PGTParser(Parser):
             # boundary checking
             if next_line == "":
                 result = '\n'.join(result_lines[ind: len(result_lines)])
-            elif result_lines[ind].strip(';') == next_line:
+            elif stripped_lines[ind] == next_line:
                 result = ""
                 # there would be something like this:
                 # --
                 # (1 row)
                 # Which would cause comment line to match --
                 if next_line == "--":
-                    if result_lines[ind + 1].strip(';') == "(1 row)":
+                    if stripped_lines[ind + 1] == "(1 row)":
                         result = "--\n(1 row)\n"
                         ind += 2
             else:
-                for j in range(ind, len(result_lines)):
-                    if result_lines[j] .strip(';') == next_line:
-                        result = '\n'.join(result_lines[ind:j])
-                        ind = j
-                        break
+                positions = line_positions.get(next_line, [])
+                k = bisect_left(positions, ind)
+                if k < len(positions):
+                    j = positions[k]
+                    result = '\n'.join(result_lines[ind:j])
+                    ind = j
             # Create new record
             self.meta_data['total_testcase'] += 1
             if re.match(r'^[\\]', command.strip()):
@@ -508,7 +577,9 @@ class PGTParser(Parser):
         # Query
         elif converted_result or is_query:
             data_type = 'I' * len(converted_result.split('\n')[0].split('\t'))
-            return Query(sql=record.sql, result=converted_result, id=record.id, res_format=ResultFormat.ROW_WISE, data_type=data_type, input_data=record.input_data)
+            query = Query(sql=record.sql, result=converted_result, id=record.id, res_format=ResultFormat.ROW_WISE, data_type=data_type, input_data=record.input_data)
+            query.compile_result()
+            return query
         logging.warning("Unknown result: %s", converted_result)
         return converted_record
 
@@ -524,14 +595,44 @@ class PGTParser(Parser):
         self.convert_records()
 
 
+class RecordLoop():
+    """A loop or foreach block of a DuckDB test file, whose body is parsed once.
+
+    The body holds the template records and the nested loops. The records of each iteration are
+    copied from the templates with the ${name} of the loop variables substituted.
+    """
+
+    def __init__(self, name: str, values, outer_records: list) -> None:
+        self.name = name
+        self.values = values
+        self.body = []
+        # the records that the loop is in, they are restored at endloop
+        self.outer_records = outer_records
+
+
 class DTParser(SLTParser):
+    LOOP_COMMANDS = ('loop', 'foreach', 'concurrentloop', 'concurrentforeach')
+    # the type lists that foreach expands, as the DuckDB test runner does
+    FOREACH_TYPES = {
+        '<integral>': ['tinyint', 'smallint', 'integer', 'bigint', 'hugeint'],
+        '<signed>': ['tinyint', 'smallint', 'integer', 'bigint', 'hugeint'],
+        '<unsigned>': ['utinyint', 'usmallint', 'uinteger', 'ubigint'],
+        '<numeric>': ['tinyint', 'smallint', 'integer', 'bigint', 'hugeint', 'float', 'double'],
+        '<alltypes>': ['tinyint', 'smallint', 'integer', 'bigint', 'hugeint', 'float', 'double',
+                       'bool', 'interval', 'varchar'],
+        '<compression>': ['none', 'uncompressed', 'rle', 'bitpacking', 'dictionary', 'fsst', 'chimp', 'patas'],
+    }
+    LOOP_VARIABLE_REGEX = re.compile(r'\$\{(\w+)\}')
+
     def __init__(self, filename='') -> None:
         super().__init__(filename)
+        self.loops: List[RecordLoop] = []
+        self.output_id = 0
 
     def testfile_dialect_handler(self, *args, **kwargs):
         record_type = kwargs['record_type']
         lines = kwargs['lines']
-        if record_type in ('loop', 'require'):
+        if record_type == 'require':
             logging.warning("This script has not implement: %s", lines)
             return Control(action=RunnerAction.HALT, id=self.record_id)
         return super().testfile_dialect_handler(*args, **kwargs)
@@ -539,6 +640,82 @@ class DTParser(SLTParser):
     def get_file_content(self):
         return super().get_file_content()
 
+    def get_loop_values(self, tokens: list):
+        """get the values of the loop variable from the loop or foreach line
+        """
+        if tokens[0].endswith('foreach'):
+            values = []
+            for token in tokens[2:]:
+                values += self.FOREACH_TYPES.get(token, [token])
+            return values
+        # loop i <begin> <end> runs from begin to end - 1
+        return range(int(tokens[2]), int(tokens[3]))
+
+    def start_loop(self, tokens: list):
+        try:
+            values = self.get_loop_values(tokens)
+        except (IndexError, ValueError):
+            logging.warning("Wrong loop in %s: %s", self.filename, ' '.join(tokens))
+            values = []
+        self.loops.append(RecordLoop(tokens[1] if len(tokens) > 1 else '', values, self.records))
+        self.records = self.loops[-1].body
+
+    def end_loop(self):
+        loop = self.loops.pop()
+        self.records = loop.outer_records
+        self.records.append(loop)
+
+    def substitute(self, text: str, variables: dict):
+        return self.LOOP_VARIABLE_REGEX.sub(
+            lambda m: str(variables.get(m.group(1), m.group())), text)
+
+    def expand_records(self, records: list, variables: dict = None):
+        """yield the records with the loops unrolled one iteration at a time, and number them
+        """
+        for record in records:
+            if type(record) is RecordLoop:
+                for value in record.values:
+                    yield from self.expand_records(record.body, dict(variables or {}, **{record.name: value}))
+                continue
+            if variables:
+                record = copy(record)
+                record.sql = self.substitute(record.sql, variables)
+                record.result = self.substitute(record.result, variables)
+            record.id = self.output_id
+            self.output_id += 1
+            yield record
+
+    def parse_scripts(self, scripts):
+        """parse the scripts one by one and yield their records
+
+        The body of a loop is kept as templates until its endloop, then its iterations are
+        generated while the records are consumed, so a long loop never lives in memory at once.
+        """
+        self.records = []
+        self.record_id = 0
+        self.output_id = 0
+        self.loops = []
+        for script in scripts:
+            self.parse_script(script)
+            if self.records and not self.loops:
+                records, self.records = self.records, []
+                yield from self.expand_records(records)
+        if self.loops:
+            logging.warning("The loop is not closed by endloop in %s", self.filename)
+            while self.loops:
+                self.end_loop()
+            records, self.records = self.records, []
+            yield from self.expand_records(records)
+
+    def parse_file(self):
+        self.scripts = list(self.iter_scripts(self.test_content.split('\n')))
+        self.records = list(self.parse_scripts(self.scripts))
+
+    def iter_records(self):
+        """read the file incrementally and yield the records, the loops are unrolled lazily
+        """
+        yield from self.parse_scripts(self.iter_scripts(self._iter_file_lines(self.filename)))
+
     def parse_script(self, script: str):
         script = strip_hash_comment_lines(script)
         if script:
@@ -546,7 +723,19 @@ class DTParser(SLTParser):
         else:
             return
         # print(self.filename, script)
-        self.dbms_set = copy(DBMS_Set)
+        self.dbms_set = ALL_DBMS
+
+        # the loop and endloop lines could be followed by a record in the same script
+        tokens = lines[0].split()
+        if tokens[0] in self.LOOP_COMMANDS or tokens[0] == 'endloop':
+            if tokens[0] != 'endloop':
+                self.start_loop(tokens)
+            elif self.loops:
+                self.end_loop()
+            else:
+                logging.warning("endloop without loop in %s", self.filename)
+            self.parse_script('\n'.join(lines[1:]))
+            return
 
         tokens = lines[0].split()
         record_type = tokens[0]
@@ -631,6 +820,8 @@ class DTParser(SLTParser):
                 # record.result = record.result.replace('(empty)', '')
                 # if record.result == 'true' or record.result == 'false':
                 #     record.result = record.result.capitalize()
+                if record.res_format == ResultFormat.ROW_WISE:
+                    record.compile_result()
                 self.records.append(record)
                 self.record_id += 1
         else:
@@ -684,6 +875,7 @@ class CDBTParser(SLTParser):
             record = self.get_query(tokens=tokens, lines=lines)
 
             record.set_resformat(ResultFormat.ROW_WISE)
+            record.compile_result()
             self.records.append(record)
             self.record_id += 1
         else:
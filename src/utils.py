@@ -1,11 +1,19 @@
 from enum import Enum
+import ast
 import logging
 import re
 import hashlib
+import heapq
 import math
+import pickle
+import tempfile
+from array import array
 from decimal import Decimal
 import pandas as pd
 from copy import copy
+from itertools import accumulate, chain
+from time import perf_counter_ns
+from typing import Iterable
 
 
 class SortType(Enum):
@@ -50,6 +58,9 @@ class DBEngineExcetion(Exception):
 
 DBMS_Set = set(['mysql', 'sqlite', 'postgresql',
                'duckdb', 'cockroachdb', 'psql'])
+# the DBMS sets of the records are interned, so the records with the same DBMS share one frozenset
+ALL_DBMS = frozenset(DBMS_Set)
+DBMS_SETS = {ALL_DBMS: ALL_DBMS}
 Suite_Set = set(['mysql', 'sqlite', 'postgresql',
                 'duckdb', 'cockroachdb', 'squality'])
 
@@ -85,7 +96,14 @@ TestCaseColumns = ['INDEX',  # testcase index
 
 ResultColumns = ['DBMS_NAME', 'TESTFILE_INDEX', 'TESTFILE_PATH', 'ORIGINAL_SUITE',
                  'TESTCASE_INDEX', 'SQL', 'CASE_TYPE', 'EXPECTED_RESULT',
-                 'ACTUAL_RESULT', 'EXEC_TIME', 'DATE', 'IS_ERROR', 'ERROR_MSG', 'LOGS_INDEX']
+                 'ACTUAL_RESULT', 'EXEC_TIME',  # microseconds spent in the DBMS (execute and fetch)
+                 'DATE', 'IS_ERROR', 'ERROR_MSG', 'LOGS_INDEX',
+                 'EXECUTE_NS', 'FETCH_NS', 'COMPARE_NS',  # nanoseconds spent in each phase of the test case
+                 ]
+
+# The per test file timing summary, nanoseconds spent in each phase
+TimingColumns = ['TESTFILE_INDEX', 'TESTFILE_PATH', 'PARSE_NS', 'CONNECT_NS', 'EXECUTE_NS',
+                 'FETCH_NS', 'COMPARE_NS', 'DUMP_NS', 'TOTAL_NS']
 
 TESTCASE_PATH = {
     'postgresql': 'postgresql_tests/regress/'
@@ -111,25 +129,39 @@ OUTPUT_PATH = {
     'testcase_dir': 'data/',
     'base': 'output/',
     'execution_result': 'output/{}_results.csv',  # means execution db engine
-    'execution_log': 'output/{}_logs.csv'
+    'execution_log': 'output/{}_logs.csv',
+    'execution_timing': 'output/{}_timing.csv',
+    'execution_parts': 'output/{}_parts/',
+    'parse_cache': 'output/parse_cache/',
+    'checkpoint': 'output/{}_checkpoint.jsonl',
 }
 
 
+def intern_dbms(db: Iterable[str]):
+    """get the shared frozenset of the DBMS names
+    """
+    db = frozenset(db)
+    return DBMS_SETS.setdefault(db, db)
+
+
 class Record:
+    __slots__ = ('sql', 'result', 'db', 'id', 'suite', 'input_data')
 
     def __init__(self, sql="", result="", suite="", input_data="", **kwargs) -> None:
         self.sql = sql
         self.result = result
-        self.db = DBMS_Set
+        self.db = ALL_DBMS
         self.id = kwargs['id']
         self.suite = suite
         self.input_data = input_data
 
-    def set_execute_db(self, db: set):
-        self.db = db
+    def set_execute_db(self, db: Iterable[str]):
+        self.db = intern_dbms(db)
 
 
 class Statement(Record):
+    __slots__ = ('status', 'affected_rows')
+
     def __init__(self, sql="", result="", status=True,
                  affected_rows=0, input_data="",  **kwargs) -> None:
         super().__init__(sql, result, input_data=input_data, ** kwargs)
@@ -138,6 +170,8 @@ class Statement(Record):
 
 
 class Query(Record):
+    __slots__ = ('data_type', 'sort', 'label', 'is_hash', 'res_format', 'expected')
+
     def __init__(self, sql="", result="", data_type="I",
                  sort=SortType.NO_SORT, label="", res_format=ResultFormat.VALUE_WISE, input_data="", is_hash=True, **kwargs) -> None:
         super().__init__(sql=sql, result=result, input_data=input_data, **kwargs)
@@ -146,22 +180,273 @@ class Query(Record):
         self.label = label
         self.is_hash = is_hash
         self.res_format = res_format
+        self.expected = None
 
     def set_resformat(self, res_format: ResultFormat):
         self.res_format = res_format
 
+    def compile_result(self):
+        """split and type the expected result once, for the row-wise comparison
+        """
+        self.expected = ExpectedResult(self.result)
+
+    def get_expected(self):
+        # compile again if the result was changed after it was compiled
+        if self.expected is None or self.expected.result != self.result:
+            self.compile_result()
+        return self.expected
+
+
+def parse_expected_item(item: str):
+    """get the python value of an expected item, like NULL, numbers, True/False and quoted strings
+
+    Returns:
+        Tuple[bool, Any]: whether the item stands for a value, and the value
+    """
+    if item == 'NULL':
+        return True, None
+    try:
+        return True, ast.literal_eval(item)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return False, None
+
+
+class ExpectedResult():
+    """The expected result of a row-wise query, split into rows of typed items.
+
+    Each item keeps its text and, if it has one, the python value it stands for. The order of
+    the rows sorted by their text is kept for the comparison of unordered results.
+    """
+
+    def __init__(self, result: str) -> None:
+        self.result = result
+        lines = result.strip().split('\n') if result else []
+        self.rows = [[(item, *parse_expected_item(item)) for item in line.strip().split('\t')]
+                     for line in lines]
+        self.sort_order = sorted(range(len(lines)), key=lines.__getitem__)
+
+    def get_sorted_rows(self):
+        return [self.rows[i] for i in self.sort_order]
+
+    def __eq__(self, other) -> bool:
+        # the rows are compiled from the result text
+        return type(other) is ExpectedResult and self.result == other.result
+
 
 class Control(Record):
+    __slots__ = ('action',)
+
     def __init__(self, sql="", result="",
                  action=RunnerAction.HALT, **kwargs) -> None:
         super().__init__(sql, result, **kwargs)
         self.action = action
 
 
+class StringColumn():
+    """A column of strings kept as one string and the end offset of each item
+    """
+    __slots__ = ('text', 'ends')
+
+    def __init__(self, items: list) -> None:
+        self.text = ''.join(items)
+        self.ends = array('q', accumulate(map(len, items)))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i: int):
+        return self.text[self.ends[i - 1] if i else 0:self.ends[i]]
+
+
+class RecordBatch():
+    """The records of a test file in parallel columns, instead of an object per record.
+
+    The string fields are kept in StringColumns, the enums and flags in byte arrays and the
+    DBMS sets as indexes of the interned sets. A record is only built when it is iterated or
+    indexed, so a runner that streams the records holds one of them at a time. The compiled
+    expected result of a query is not kept, it is compiled again on its first comparison.
+    """
+    STRING_FIELDS = ('sql', 'result', 'suite', 'input_data', 'data_type', 'label')
+    RECORD_TYPES = {Statement: RecordType.STATEMENT.value,
+                    Query: RecordType.QUERY.value,
+                    Control: RecordType.CONTROL.value}
+
+    def __init__(self, records: Iterable[Record] = ()) -> None:
+        strings = {field: [] for field in self.STRING_FIELDS}
+        self.types = bytearray()
+        self.ids = array('q')
+        self.dbs = array('H')
+        self.db_sets = []
+        # status of a statement, is_hash of a query
+        self.flags = bytearray()
+        # sort of a query, action of a control
+        self.codes = bytearray()
+        self.res_formats = bytearray()
+        self.affected_rows = array('q')
+        db_index = {}
+        for record in records:
+            record_type = self.RECORD_TYPES[type(record)]
+            self.types.append(record_type)
+            self.ids.append(record.id)
+            index = db_index.get(record.db)
+            if index is None:
+                index = db_index[record.db] = len(self.db_sets)
+                self.db_sets.append(intern_dbms(record.db))
+            self.dbs.append(index)
+            for field, column in strings.items():
+                column.append(getattr(record, field, ''))
+            if record_type == RecordType.STATEMENT.value:
+                self.flags.append(bool(record.status))
+                self.codes.append(0)
+                self.res_formats.append(0)
+                self.affected_rows.append(record.affected_rows)
+            elif record_type == RecordType.QUERY.value:
+                self.flags.append(bool(record.is_hash))
+                self.codes.append(record.sort.value)
+                self.res_formats.append(record.res_format.value)
+                self.affected_rows.append(0)
+            else:
+                self.flags.append(0)
+                self.codes.append(record.action.value)
+                self.res_formats.append(0)
+                self.affected_rows.append(0)
+        self.strings = {field: StringColumn(column) for field, column in strings.items()}
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self[i]
+
+    def __getitem__(self, i: int):
+        record_type = self.types[i]
+        strings = self.strings
+        # fill the slots directly, the ids are not passed to __init__ as in the parsers
+        if record_type == RecordType.STATEMENT.value:
+            record = Statement.__new__(Statement)
+            record.status = bool(self.flags[i])
+            record.affected_rows = self.affected_rows[i]
+        elif record_type == RecordType.QUERY.value:
+            record = Query.__new__(Query)
+            record.data_type = strings['data_type'][i]
+            record.sort = SortType(self.codes[i])
+            record.label = strings['label'][i]
+            record.is_hash = bool(self.flags[i])
+            record.res_format = ResultFormat(self.res_formats[i])
+            record.expected = None
+        else:
+            record = Control.__new__(Control)
+            record.action = RunnerAction(self.codes[i])
+        record.sql = strings['sql'][i]
+        record.result = strings['result'][i]
+        record.db = self.db_sets[self.dbs[i]]
+        record.id = self.ids[i]
+        record.suite = strings['suite'][i]
+        record.input_data = strings['input_data'][i]
+        return record
+
+    def __setstate__(self, state: dict):
+        # the DBMS sets are interned again after loading
+        self.__dict__.update(state)
+        self.db_sets = [intern_dbms(db) for db in self.db_sets]
+
+
+class TimerPhase():
+    """The context manager that adds the time spent in it to a phase of the PhaseTimer"""
+    __slots__ = ('timer', 'phase', 'begin')
+
+    def __init__(self, timer, phase: str) -> None:
+        self.timer = timer
+        self.phase = phase
+        self.begin = 0
+
+    def __enter__(self):
+        if self.timer.depth == 0:
+            self.begin = perf_counter_ns()
+        self.timer.depth += 1
+
+    def __exit__(self, *args):
+        self.timer.depth -= 1
+        if self.timer.depth == 0:
+            self.timer.add(self.phase, perf_counter_ns() - self.begin)
+
+
+class PhaseTimer():
+    """Accumulate the time spent in each phase of a test file and of its current test case.
+
+    The time is measured by perf_counter_ns. The phases of a test file are parse, connect,
+    execute, fetch, compare and dump, a test case only has the execute, fetch and compare ones.
+    A phase started inside another one (e.g. statements executed while connecting) is counted
+    as the outer phase.
+    """
+    FILE_PHASES = ['parse', 'connect', 'execute', 'fetch', 'compare', 'dump']
+    RECORD_PHASES = ['execute', 'fetch', 'compare']
+
+    def __init__(self) -> None:
+        self.file_begin = perf_counter_ns()
+        self.file_times = {}.fromkeys(self.FILE_PHASES + ['total'], 0)
+        self.record_times = {}.fromkeys(self.RECORD_PHASES, 0)
+        self.depth = 0
+        self.phases = {phase: TimerPhase(self, phase)
+                       for phase in self.FILE_PHASES}
+
+    def start_file(self):
+        self.file_begin = perf_counter_ns()
+        self.file_times = {}.fromkeys(self.FILE_PHASES + ['total'], 0)
+
+    def end_file(self):
+        self.file_times['total'] = perf_counter_ns() - self.file_begin
+
+    def merge_file(self, file_times: dict):
+        """Take over the file times measured by another timer (e.g. in a worker process)
+        """
+        self.file_times = dict(file_times)
+        self.file_begin = perf_counter_ns() - file_times['total']
+
+    def start_record(self):
+        record_times = self.record_times
+        record_times['execute'] = record_times['fetch'] = record_times['compare'] = 0
+
+    def split_record(self, num: int):
+        """share the times of the current test case among num test cases, e.g. a batch of statements
+        """
+        record_times = self.record_times
+        for phase in self.RECORD_PHASES:
+            record_times[phase] //= num
+
+    def add(self, phase: str, duration: int):
+        self.file_times[phase] += duration
+        if phase in self.record_times:
+            self.record_times[phase] += duration
+
+    def phase(self, phase: str):
+        return self.phases[phase]
+
+    def get_exec_time(self):
+        """get the microseconds that the current test case spent in the DBMS
+        """
+        return (self.record_times['execute'] + self.record_times['fetch']) // 1000
+
+
 def my_debug(mystr: str, *args):
     logging.debug(mystr, *args)
 
 
+def read_results_csv(path: str):
+    """read a results csv, the columns that a csv from an older run doesn't have are filled with 0
+    (e.g. EXECUTE_NS, FETCH_NS and COMPARE_NS)
+
+    Returns:
+        pd.DataFrame: the results with all the ResultColumns
+    """
+    results = pd.read_csv(path, na_filter=False)
+    for column in ResultColumns:
+        if column not in results.columns:
+            results[column] = 0
+    return results
+
+
 def convert_testfile_name(path: str, dbms: str):
     return "-".join(path.replace(".test", ".csv").replace(".sql", ".csv").split('/')[1:])
 
@@ -214,6 +499,37 @@ def convert_postgres_result(result: str):
         return result, is_query
 
 
+NoneType = type(None)
+
+# the python types that each data type letter could format with a single builtin function,
+# which gives the same string as the per-item format function of ResultHelper
+FAST_FORMAT = {
+    'I': ({int}, str),
+    'R': ({float, int}, '%.3f'.__mod__),
+    'T': ({str}, str),
+}
+
+
+class ColumnarResult():
+    """The results of a query fetched column by column, e.g. by DuckDB fetchnumpy.
+
+    The value-wise comparison formats the columns directly, the rows are only built for the
+    other comparisons.
+    """
+
+    def __init__(self, columns: list) -> None:
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __repr__(self):
+        return repr(self.to_rows())
+
+    def to_rows(self):
+        return list(zip(*self.columns))
+
+
 class ResultHelper():
     def __init__(self, results, record: Record) -> None:
         self.results = results
@@ -270,12 +586,72 @@ class ResultHelper():
         return str(item) if item != None else "NULL"
 
     def format_results(self, results, datatype: str):
-        cols = list(datatype)
+        """format the results by the data type letters, returns the formatted rows
+        """
+        columns = self.format_columns(results, datatype)
+        if columns is None:
+            format_func = {'I': self.int_format,
+                           'R': self.float_format, 'T': self.text_format}
+            return [[format_func[col](item) for col, item in zip(datatype, row)] for row in results]
+        return [list(row) for row in zip(*columns)]
+
+    def format_column(self, column, col_type: str):
+        """format a whole column of the results in one pass
+
+        A column that only holds the expected python types (and NULL) is formatted by a single
+        map with the builtin format function, others go through the per-item format function.
+
+        Args:
+            column (tuple): the items of the column
+            col_type (str): the data type letter, 'I', 'R' or 'T'
+        """
         format_func = {'I': self.int_format,
-                       'R': self.float_format, 'T': self.text_format}
-        results = [[format_func[col](item) for col, item in zip(
-            cols, row)] for row in results]
-        return results
+                       'R': self.float_format, 'T': self.text_format}[col_type]
+        fast_types, fast_func = FAST_FORMAT[col_type]
+        types = set(map(type, column))
+        has_null = NoneType in types
+        types.discard(NoneType)
+        if not types <= fast_types:
+            return list(map(format_func, column))
+        if has_null:
+            return [fast_func(item) if item is not None else "NULL" for item in column]
+        return list(map(fast_func, column))
+
+    def format_columns(self, results, datatype: str):
+        """format the results column by column
+
+        Returns:
+            list: the formatted columns, or None if the rows are not of the same length
+        """
+        width = len(results[0])
+        for row in results:
+            if len(row) != width:
+                return None
+        return [self.format_column(column, col_type) for col_type, column in zip(datatype, zip(*results))]
+
+    def join_columns(self, columns, sort_type=SortType.NO_SORT):
+        """sort the formatted columns and join them into the result string, one value per line
+        """
+        if not columns or not columns[0]:
+            return ''
+        if sort_type == SortType.ROW_SORT:
+            rows = list(zip(*columns))
+            rows.sort()
+            return '\n'.join(chain.from_iterable(rows)) + '\n'
+        # the flat list of values in row order
+        width = len(columns)
+        if width == 1:
+            result_flat = list(columns[0])
+        else:
+            result_flat = [None] * (width * len(columns[0]))
+            for j, column in enumerate(columns):
+                result_flat[j::width] = column
+        if sort_type == SortType.VALUE_SORT:
+            # sort the values with their line breaks, as the line break is part of the order
+            result_flat = [item + '\n' for item in result_flat]
+            result_flat.sort()
+            return ''.join(result_flat)
+        return '\n'.join(result_flat) + '\n'
 
     def sort_result(self, results, sort_type=SortType.ROW_SORT):
         """sort the result (rows of the results)
@@ -285,36 +661,37 @@ class ResultHelper():
         Returns:
             str: A str of results
         """
-        result_flat = []
-        if sort_type == SortType.ROW_SORT:
-            results = [list(map(str, row)) for row in results]
-            results.sort()
-            for row in results:
-                for item in row:
-                    result_flat.append(item+'\n')
-        elif sort_type == SortType.VALUE_SORT:
-            for row in results:
-                for item in row:
-                    result_flat.append(str(item)+'\n')
-            result_flat.sort()
-        else:
-            for row in results:
-                for item in row:
-                    result_flat.append(str(item)+'\n')
-        # myDebug(result_flat)
-        return ''.join(result_flat)
+        if not results:
+            return ''
+        if len(set(map(len, results))) != 1:
+            # the rows are not of the same length
+            result_flat = [[str(item) for item in row] for row in results]
+            if sort_type == SortType.ROW_SORT:
+                result_flat.sort()
+            result_flat = [item + '\n' for row in result_flat for item in row]
+            if sort_type == SortType.VALUE_SORT:
+                result_flat.sort()
+            return ''.join(result_flat)
+        columns = [list(map(str, column)) for column in zip(*results)]
+        return self.join_columns(columns, sort_type)
 
     def value_wise_compare(self, results, record, hash_threshold, is_hash=True):
         result_string = ""
-        if results:
+        if isinstance(results, ColumnarResult):
+            result_len = len(results) * len(results.columns)
+            if result_len:
+                result_string = self.join_columns([self.format_column(column, col_type) for col_type, column in zip(
+                    record.data_type, results.columns)], record.sort)
+        elif results:
             result_len = len(results) * len(results[0])
             # Format the result by the query command para
-            results_fmt = self.format_results(
-                results=results, datatype=record.data_type)
-            # sort result and output flat list
-            # myDebug(results_fmt)
-            result_string = self.sort_result(
-                results_fmt, sort_type=record.sort)
+            columns = self.format_columns(results, record.data_type)
+            if columns is None:
+                # sort result and output flat list
+                result_string = self.sort_result(
+                    self.format_results(results, record.data_type), sort_type=record.sort)
+            else:
+                result_string = self.join_columns(columns, record.sort)
         else:
             result_len = 0
         if is_hash and result_len > hash_threshold:
@@ -324,44 +701,35 @@ class ResultHelper():
         cmp_flag = result_string.strip() == record.result.strip()
         return cmp_flag, result_string
 
-    def _row_wise_compare_str(self, actual_results, expected_results):
-        NULL = None
-        if len(expected_results) == len(actual_results) == 0:
-            cmp_flag = True
-        elif len(expected_results) != len(actual_results):
-            cmp_flag = False
-        else:
-            for i, row in enumerate(expected_results):
-                items = row.strip().split('\t')
-                # my_debug("%s, %s", str(items), str(actual_results[i]))
-                if len(items) != len(actual_results[i]):
-                    cmp_flag = False
-                    break
-                for j, item in enumerate(items):
-                    # direct comparison
-                    rvalue = actual_results[i][j]
-                    if type(rvalue) is str:
-                        rvalue = rvalue.replace('\0', '\\0')
-                    # my_debug("lvalue = [%s], rvalue = [%s]",item, rvalue)
-                    cmp_flag = item is rvalue
-                    cmp_flag = item == str(rvalue) or cmp_flag
-                    # if DuckDB
-                    cmp_flag = item == '(empty)' and rvalue == '' or cmp_flag
-                    if not cmp_flag:
-                        try:
-                            lvalue = eval(item)
-                        except (TypeError, SyntaxError, NameError):
-                            continue
-                        cmp_flag = lvalue == rvalue or cmp_flag
-                        # if numeric (No, even data type is I, still would have float type
-                        if type(lvalue) is float and type(rvalue) is float:
-                            cmp_flag = math.isclose(
-                                lvalue, rvalue) or cmp_flag
-                if not cmp_flag:
-                    break
-        result_string = '\n'.join(['\t'.join(
-            [str(item).replace('\0', '\\0') if item != None else 'NULL' for item in row]) for row in actual_results])
-        return cmp_flag, result_string
+    def _match_item(self, expected_item, rvalue):
+        """compare an actual item with a typed expected item
+        """
+        item, has_value, lvalue = expected_item
+        if type(rvalue) is str:
+            rvalue = rvalue.replace('\0', '\\0')
+        # direct comparison, (empty) is the empty string in DuckDB
+        if item == str(rvalue) or item == '(empty)' and rvalue == '':
+            return True
+        if has_value:
+            if lvalue == rvalue:
+                return True
+            # if numeric (No, even data type is I, still would have float type
+            if type(lvalue) is float and type(rvalue) is float and math.isclose(lvalue, rvalue):
+                return True
+        return False
+
+    def _row_wise_compare_rows(self, actual_results, expected_rows):
+        """compare the actual rows with the typed expected rows, stop at the first mismatch
+        """
+        if len(expected_rows) != len(actual_results):
+            return False
+        for expected_row, row in zip(expected_rows, actual_results):
+            if len(expected_row) != len(row):
+                return False
+            for expected_item, rvalue in zip(expected_row, row):
+                if not self._match_item(expected_item, rvalue):
+                    return False
+        return True
 
     def row_wise_compare(self, results, record: Record):
         # the result is just what we want.
@@ -370,23 +738,21 @@ class ResultHelper():
                 return True, results
             else:
                 return False, results
-        expected_result_list = record.result.strip().split('\n') if record.result else []
-        cmp_flag = False
-        actual_result_list = copy(results)
-        # actually_result_list.sort()
-        # sort the actual result list based on the string
-        my_debug("%s, %s", actual_result_list, expected_result_list)
-        cmp_flag, result_string = self._row_wise_compare_str(
-            actual_result_list, expected_result_list)
-        # if the result is same, just end here
-        if cmp_flag:
-            return cmp_flag, result_string
+        expected = record.get_expected()
+        my_debug("%s, %s", results, expected.result)
+        cmp_flag = self._row_wise_compare_rows(results, expected.rows)
         # if not, try to sort the result and do again
-        expected_result_list.sort()
-        actual_result_list = sorted(actual_result_list, key=str)
-        cmp_flag, result_string = self._row_wise_compare_str(
-            actual_result_list, expected_result_list)
-        return cmp_flag, result_string
+        if not cmp_flag:
+            results = sorted(results, key=str)
+            cmp_flag = self._row_wise_compare_rows(
+                results, expected.get_sorted_rows())
+        return cmp_flag, self.rows_to_string(results)
+
+    def rows_to_string(self, results):
+        """get the row-wise result string, a line of tab separated items per row
+        """
+        return '\n'.join(['\t'.join(
+            [str(item).replace('\0', '\\0') if item != None else 'NULL' for item in row]) for row in results])
 
     def regex_compare(self, results, record: Record):
         cmp_flag = False
@@ -406,3 +772,214 @@ class ResultHelper():
 
     def cast_result_list(self, results: str, old, new):
         return [row.replace(old, new) for row in results]
+
+
+class RowMatcher():
+    """Compare the rows of a NO_SORT row-wise query to the expected rows while fetching them.
+
+    A result with more rows than the expected ones never matches, even after sorting. So the
+    rows are only kept up to that point, then the fetching stops and the first rows are kept as
+    the actual result.
+    """
+
+    def __init__(self, record: Query, max_actual_rows: int) -> None:
+        self.record = record
+        self.max_actual_rows = max_actual_rows
+        self.expected_num = len(record.get_expected().rows)
+        self.rows = []
+        self.done = False
+
+    @staticmethod
+    def is_streamable(record: Query):
+        return record.res_format == ResultFormat.ROW_WISE and record.sort == SortType.NO_SORT and \
+            not (record.label != '' and record.result == '')
+
+    def update(self, rows: list):
+        self.rows += rows
+        if len(self.rows) > self.expected_num:
+            self.done = True
+
+    def finish(self):
+        """finish the comparison after the last batch
+
+        Returns:
+            Tuple[bool, str]: whether the results match, and the result string to dump
+        """
+        helper = ResultHelper(self.rows, self.record)
+        if not self.done:
+            return helper.row_wise_compare(self.rows, self.record)
+        logging.debug("Query %s returns more than %d rows, stop fetching",
+                      self.record.sql, self.expected_num)
+        result_string = helper.rows_to_string(self.rows[:self.max_actual_rows])
+        self.rows = []
+        return False, result_string + '\n...'
+
+
+HASH_RESULT_REGEX = re.compile(r'^\s*[0-9]+ values hashing to [0-9a-f]{32}\s*$')
+
+
+class ResultHasher():
+    """Compare the results of a query, whose expected result is a md5 hash, while fetching them.
+
+    The rows are fed batch by batch and go into an incremental md5, so the whole result string
+    is never built. For the NO_SORT queries only the first values are kept (in case the results
+    are too few to be hashed). The sorted queries keep the formatted rows, and once they take
+    more than the memory limit they are sorted and spilled to a temp file, then the spilled runs
+    are merged while hashing.
+    """
+    SPILL_BLOCK = 1000
+    # a hash needs all the rows
+    done = False
+
+    def __init__(self, record: Query, hash_threshold: int, memory_limit: int) -> None:
+        self.record = record
+        self.hash_threshold = hash_threshold
+        self.memory_limit = memory_limit
+        self.helper = ResultHelper([], record)
+        self.md5 = hashlib.md5()
+        self.result_len = 0
+        self.width = None
+        # the formatted results of the first rows, or of all rows if they need sorting
+        self.buffer = []
+        self.buffer_size = 0
+        self.runs = []
+
+    @staticmethod
+    def is_streamable(record: Query):
+        """whether the record only needs the hash of its results
+        """
+        if record.label != '' and record.result == '':
+            return False
+        if record.res_format == ResultFormat.HASH:
+            return True
+        return record.res_format == ResultFormat.VALUE_WISE and record.is_hash and \
+            HASH_RESULT_REGEX.match(record.result) is not None
+
+    def update(self, rows: list):
+        """feed a batch of rows fetched from the cursor
+        """
+        if not rows:
+            return
+        if self.record.res_format == ResultFormat.HASH:
+            self.result_len += len(rows)
+            self.md5.update(('\n'.join(['\n'.join(
+                [str(item) if item != None else 'NULL' for item in row]) for row in rows]) + '\n').encode(encoding='utf-8'))
+            return
+        if self.width is None:
+            self.width = len(rows[0])
+        columns = self.helper.format_columns(rows, self.record.data_type)
+        # the rows are not of the same length, fall back to the formatted rows
+        formatted = self.helper.format_results(
+            rows, self.record.data_type) if columns is None else None
+        self.add_formatted(columns, formatted, len(rows))
+
+    def update_columns(self, columns: list):
+        """feed a batch of results fetched column by column
+        """
+        if not columns or not columns[0]:
+            return
+        row_num = len(columns[0])
+        if self.record.res_format == ResultFormat.HASH:
+            self.result_len += row_num
+            self.md5.update(self.helper.join_columns([[str(item) if item is not None else 'NULL' for item in column]
+                                                      for column in columns]).encode(encoding='utf-8'))
+            return
+        if self.width is None:
+            self.width = len(columns)
+        self.add_formatted([self.helper.format_column(column, col_type) for col_type, column in zip(
+            self.record.data_type, columns)], None, row_num)
+
+    def add_formatted(self, columns: list, formatted: list, row_num: int):
+        """hash or buffer a batch of formatted results, given as columns or else as rows
+        """
+        self.result_len += row_num * self.width
+        sort_type = self.record.sort
+        if sort_type == SortType.NO_SORT:
+            chunk = self.helper.join_columns(columns) if formatted is None else \
+                self.helper.sort_result(formatted, sort_type)
+            self.md5.update(chunk.encode(encoding='utf-8'))
+            if self.buffer is not None:
+                self.buffer.append(chunk)
+                if self.result_len > self.hash_threshold:
+                    self.buffer = None
+            return
+        if formatted is None:
+            values = list(zip(*columns)) if sort_type == SortType.ROW_SORT else \
+                [item + '\n' for column in columns for item in column]
+            size = sum(sum(map(len, column)) for column in columns)
+        else:
+            values = [tuple(row) for row in formatted] if sort_type == SortType.ROW_SORT else \
+                [item + '\n' for row in formatted for item in row]
+            size = 0
+        self.buffer += values
+        # the size of the strings and a rough overhead of the python objects
+        self.buffer_size += size + 64 * row_num * self.width
+        if self.buffer_size > self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        """sort the buffered results and move them to a temp file
+        """
+        self.buffer.sort()
+        run = tempfile.TemporaryFile()
+        for i in range(0, len(self.buffer), self.SPILL_BLOCK):
+            pickle.dump(self.buffer[i:i + self.SPILL_BLOCK], run,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+        self.buffer_size = 0
+
+    def read_run(self, run):
+        try:
+            while True:
+                yield from pickle.load(run)
+        except EOFError:
+            run.close()
+
+    def sorted_chunks(self):
+        """get the sorted results as strings of SPILL_BLOCK items
+        """
+        if self.runs:
+            if self.buffer:
+                self.spill()
+            items = heapq.merge(*[self.read_run(run) for run in self.runs])
+        else:
+            self.buffer.sort()
+            items = iter(self.buffer)
+        while True:
+            block = [item for _, item in zip(range(self.SPILL_BLOCK), items)]
+            if not block:
+                break
+            if self.record.sort == SortType.ROW_SORT:
+                yield ''.join([item + '\n' for row in block for item in row])
+            else:
+                yield ''.join(block)
+
+    def finish(self):
+        """finish the comparison after the last batch
+
+        Returns:
+            Tuple[bool, str]: whether the results match, and the result string to dump
+        """
+        if self.record.res_format == ResultFormat.HASH:
+            if self.result_len == 0:
+                self.md5.update('\n'.encode(encoding='utf-8'))
+            result_string = self.md5.hexdigest()
+            return self.record.result.find(result_string) != -1, result_string
+        if self.record.sort == SortType.NO_SORT:
+            if self.result_len > self.hash_threshold:
+                result_string = str(self.result_len) + \
+                    " values hashing to " + self.md5.hexdigest()
+            else:
+                result_string = ''.join(self.buffer)
+        elif self.result_len > self.hash_threshold:
+            for chunk in self.sorted_chunks():
+                self.md5.update(chunk.encode(encoding='utf-8'))
+            result_string = str(self.result_len) + \
+                " values hashing to " + self.md5.hexdigest()
+        else:
+            result_string = ''.join(self.sorted_chunks())
+        self.buffer = []
+        cmp_flag = result_string.strip() == self.record.result.strip()
+        return cmp_flag, result_string
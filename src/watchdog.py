@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+
+
+class QueryWatchdog():
+    """Cancel the running SQL once it runs longer than its time budget.
+
+    The runner arms the watchdog before executing a SQL and disarms it afterwards. A daemon
+    thread waits for the deadline of the armed SQL and calls the cancel function, which should
+    use the native interrupt of the DBMS connector. Unlike SIGALRM it works outside of the main
+    thread and supports sub-second budgets.
+
+    Only the call into the DBMS is interrupted: the time spent in python to format and compare
+    the rows that were fetched is not bounded by the budget.
+    """
+    # the seconds that disarm waits for a cancel in flight before it warns about it
+    CANCEL_WAIT = 1.0
+
+    def __init__(self, cancel) -> None:
+        """
+        Args:
+            cancel (Callable): interrupt the SQL that is running on the connection
+        """
+        self.cancel = cancel
+        self.cond = threading.Condition()
+        self.deadline = None
+        self.fired = False
+        self.cancelling = False
+        self.thread = None
+
+    def arm(self, timeout: float):
+        """start the time budget of the next SQL
+
+        Args:
+            timeout (float): the time budget in seconds
+        """
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.watch, name="QueryWatchdog", daemon=True)
+                self.thread.start()
+            self.fired = False
+            self.deadline = time.monotonic() + timeout
+            self.cond.notify()
+
+    def disarm(self):
+        """stop the time budget of the SQL
+
+        Returns:
+            bool: whether the SQL was cancelled because of the timeout
+        """
+        with self.cond:
+            self.deadline = None
+            # a late cancel (e.g. a MySQL KILL QUERY) would hit the next SQL on the connection,
+            # so the runner waits for the cancel in flight
+            if not self.cond.wait_for(lambda: not self.cancelling, self.CANCEL_WAIT):
+                logging.warning("The cancel of the timeout SQL takes more than %s seconds",
+                                self.CANCEL_WAIT)
+                self.cond.wait_for(lambda: not self.cancelling)
+            return self.fired
+
+    def watch(self):
+        with self.cond:
+            while True:
+                if self.deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                self.deadline = None
+                self.fired = True
+                self.cancelling = True
+                cancel = self.cancel
+                # the cancel could connect to the server (e.g. MySQL KILL QUERY), so it runs without the lock
+                self.cond.release()
+                try:
+                    cancel()
+                except Exception as e:
+                    logging.warning("Failed to cancel the timeout SQL: %s", e)
+                finally:
+                    self.cond.acquire()
+                self.cancelling = False
+                self.cond.notify_all()
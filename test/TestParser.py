@@ -0,0 +1,406 @@
+from src import testparser
+from src.parsecache import ParseCache
+from src import testcollector
+from scripts import extract_testcases
+from src.psqlsplitter import split_psql_script
+from src.utils import RecordBatch, ResultFormat, ResultHelper, Record, Control, Query
+import math
+import random
+import re
+import pandas as pd
+import sqlparse
+
+DEMO_TEST = "demo/sqlite_tests-index-orderby_nosort-10-slt_good_23.test"
+
+
+def parse(parser: testparser.Parser, test_file: str):
+    parser.get_file_name(test_file)
+    parser.get_file_content()
+    parser.parse_file()
+    return parser.get_records()
+
+
+def get_fields(record):
+    # the expected result is compiled from the result on demand
+    return {name: getattr(record, name) for cls in type(record).__mro__
+            for name in getattr(cls, '__slots__', ()) if name != 'expected'}
+
+
+def same_records(records, expected_records):
+    assert len(records) == len(expected_records)
+    for record, expected in zip(records, expected_records):
+        assert type(record) is type(expected)
+        assert get_fields(record) == get_fields(expected)
+
+
+def test_parse_cache(tmp_path):
+    expected_records = parse(testparser.SLTParser(), DEMO_TEST)
+
+    cache = ParseCache(str(tmp_path))
+    same_records(cache.parse(testparser.SLTParser(), DEMO_TEST), expected_records)
+    same_records(cache.parse(testparser.SLTParser(), DEMO_TEST), expected_records)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # another parser never reuses the records
+    cache.parse(testparser.DTParser(), DEMO_TEST)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # the changed file is parsed again
+    test_file = tmp_path / "changed.test"
+    test_file.write_text("statement ok\nCREATE TABLE t1(a INTEGER)\n")
+    assert len(cache.parse(testparser.SLTParser(), str(test_file))) == 1
+    test_file.write_text("statement ok\nCREATE TABLE t1(a INTEGER)\n\nstatement ok\nDROP TABLE t1\n")
+    assert len(cache.parse(testparser.SLTParser(), str(test_file))) == 2
+    assert cache.misses == 4
+
+
+def test_record_batch(tmp_path):
+    for parser_class in (testparser.SLTParser, testparser.DTParser):
+        records = parse(parser_class(), DEMO_TEST)
+        batch = RecordBatch(records)
+        same_records(list(batch), records)
+        same_records([batch[i] for i in range(len(batch))], records)
+
+    # the records with the same DBMS share a single set
+    test_file = tmp_path / "dbms.test"
+    test_file.write_text("skipif mysql\nstatement ok\nSELECT 1\n\nskipif mysql\nstatement ok\nSELECT 2\n\n"
+                         "onlyif sqlite\nquery I rowsort\nSELECT 3\n----\n3\n")
+    records = parse(testparser.SLTParser(), str(test_file))
+    assert records[0].db is records[1].db and 'mysql' not in records[0].db
+    assert records[2].db == {'sqlite'}
+    batch = RecordBatch(records)
+    same_records(list(batch), records)
+    assert batch[0].db is records[0].db
+
+
+def test_parquet_corpus(tmp_path):
+    records = parse(testparser.SLTParser(), DEMO_TEST)
+    (tmp_path / "sqlite").mkdir()
+    collector = testcollector.TestcaseCollector(str(tmp_path) + "/")
+    collector.init_testcase_schema("sqlite", "demo.csv", file_format='parquet')
+    collector.save_records(records)
+    collector.dump()
+    assert collector.output_path == str(tmp_path / "sqlite" / "demo.parquet")
+
+    same_records(parse(testparser.CSVParser(), collector.output_path), records)
+    queries = testcollector.read_parquet_testcases(str(tmp_path), columns=['SQL', 'SORT_TYPE', 'TESTFILE_PATH'],
+                                                   filters={'TYPE': 'QUERY'})
+    assert list(queries.columns) == ['SQL', 'SORT_TYPE', 'TESTFILE_PATH']
+    assert list(queries['SQL']) == [record.sql for record in records if type(record).__name__ == 'Query']
+    assert set(queries['TESTFILE_PATH']) == {collector.output_path}
+    text = testcollector.read_parquet_testcases(
+        collector.output_path, columns=['STATUS', 'SORT_TYPE', 'LABEL'], as_text=True)
+    # the missing values of the statements are '' like in the csv files
+    assert set(text['STATUS']) == {'True'} and set(text['SORT_TYPE']) <= {'', '1', '2', '3'}
+    assert '' in set(text['LABEL'])
+
+
+def test_row_wise_expected(tmp_path):
+    test_file = tmp_path / "row_wise.test"
+    test_file.write_text("query IIT\nSELECT 1, NULL, 'a'\n----\n1\tNULL\ta\n2\t3.5\ttrue\n")
+    query = parse(testparser.DTParser(), str(test_file))[0]
+    assert query.res_format == ResultFormat.ROW_WISE
+    assert query.expected.rows == [[('1', True, 1), ('NULL', True, None), ('a', False, None)],
+                                   [('2', True, 2), ('3.5', True, 3.5), ('True', True, True)]]
+
+    helper = ResultHelper([], query)
+    assert helper.row_wise_compare([(2, 3.5, True), (1, None, 'a')], query)[0]
+    assert not helper.row_wise_compare([(1, None, 'b'), (2, 3.5, True)], query)[0]
+    # a mismatch in any item fails the row, not only in the last one
+    assert not helper.row_wise_compare([(1, 0, 'a'), (2, 3.5, True)], query)[0]
+
+
+def old_row_wise_compare(results, expected_result: str, strict=False):
+    """the verdict of the eval based row-wise comparison
+
+    The old loop let the last item of a row decide the row, with strict every item has to match.
+    """
+    def compare_item(item, rvalue):
+        NULL = None
+        if type(rvalue) is str:
+            rvalue = rvalue.replace('\0', '\\0')
+        cmp_flag = item is rvalue
+        cmp_flag = item == str(rvalue) or cmp_flag
+        cmp_flag = item == '(empty)' and rvalue == '' or cmp_flag
+        if not cmp_flag:
+            try:
+                lvalue = eval(item)
+            except (TypeError, SyntaxError, NameError):
+                return cmp_flag
+            cmp_flag = lvalue == rvalue or cmp_flag
+            if type(lvalue) is float and type(rvalue) is float:
+                cmp_flag = math.isclose(lvalue, rvalue) or cmp_flag
+        return cmp_flag
+
+    def compare(actual_results, expected_results):
+        if len(expected_results) != len(actual_results):
+            return False
+        for row, actual_row in zip(expected_results, actual_results):
+            items = row.strip().split('\t')
+            if len(items) != len(actual_row):
+                return False
+            flags = [compare_item(item, rvalue) for item, rvalue in zip(items, actual_row)]
+            if not (all(flags) if strict else flags[-1]):
+                return False
+        return True
+    expected_results = expected_result.strip().split('\n') if expected_result else []
+    if compare(results, expected_results):
+        return True
+    return compare(sorted(results, key=str), sorted(expected_results))
+
+
+ROW_WISE_VALUES = [0, 1, -2, 3.5, 1e20, 0.1 + 0.2, 'a', 'b c', '', '1', 'NULL', None, True, False]
+
+
+def expected_text(item):
+    return 'NULL' if item is None else str(item)
+
+
+def test_row_wise_verdict():
+    rand = random.Random(11)
+    for _ in range(5000):
+        width = rand.randint(1, 3)
+        results = [tuple(rand.choice(ROW_WISE_VALUES) for _ in range(width)) for _ in range(rand.randint(0, 4))]
+        expected_rows = [[expected_text(item) for item in row] for row in results]
+        # change some items, swap some rows, or drop a row
+        for row in expected_rows:
+            for j in range(width):
+                if rand.random() < 0.2:
+                    row[j] = rand.choice(['0', '0.3', '3.50', "'a'", '(empty)', 'x', '1e20', 'True', 'NULL'])
+        if expected_rows and rand.random() < 0.3:
+            rand.shuffle(expected_rows)
+        if expected_rows and rand.random() < 0.1:
+            expected_rows.pop()
+        result = '\n'.join('\t'.join(row) for row in expected_rows)
+        query = Query(sql="SELECT 1", result=result, res_format=ResultFormat.ROW_WISE, id=0)
+        assert ResultHelper([], query).row_wise_compare(list(results), query)[0] == \
+            old_row_wise_compare(list(results), result, strict=True)
+
+
+def test_iter_records(tmp_path):
+    for parser_class in (testparser.SLTParser, testparser.DTParser):
+        expected_records = parse(parser_class(), DEMO_TEST)
+        parser = parser_class()
+        parser.get_file_name(DEMO_TEST)
+        same_records(list(parser.iter_records()), expected_records)
+
+    # the bytes that are not utf-8 are windows-1252, in the streaming and the eager readers alike
+    test_file = tmp_path / "encoding.test"
+    test_file.write_bytes("statement ok\nCREATE TABLE t1(a TEXT)\n\nstatement ok\nINSERT INTO t1 VALUES('\u00e9\u20ac')\n\n"
+                          "statement ok\r\nINSERT INTO t1 VALUES('".encode('utf-8') + b"\xe9\x80')\r\n\n"
+                          b"statement ok\nINSERT INTO t1 VALUES('\xc3\xa9')\n")
+    for parser_class in (testparser.SLTParser, testparser.DTParser):
+        parser = parser_class()
+        parser.get_file_name(str(test_file))
+        records = parse(parser_class(), str(test_file))
+        same_records(list(parser.iter_records()), records)
+        assert [record.sql for record in records[1:]] == ["INSERT INTO t1 VALUES('\u00e9\u20ac')"] * 2 + \
+            ["INSERT INTO t1 VALUES('\u00e9')"]
+
+
+def test_duckdb_loops(tmp_path):
+    test_file = tmp_path / "loops.test"
+    test_file.write_text("loop i 0 2\n\nstatement ok\nINSERT INTO t VALUES (${i})\n\n"
+                         "foreach type integer <unsigned>\nquery I\nSELECT CAST(${i} AS ${type})\n----\n${i}\n\n"
+                         "endloop\n\nendloop\n\nstatement ok\nDROP TABLE t\n")
+    records = parse(testparser.DTParser(), str(test_file))
+    assert [record.sql for record in records[:6]] == [
+        "INSERT INTO t VALUES (0)", "SELECT CAST(0 AS integer)", "SELECT CAST(0 AS utinyint)",
+        "SELECT CAST(0 AS usmallint)", "SELECT CAST(0 AS uinteger)", "SELECT CAST(0 AS ubigint)"]
+    assert records[7].result == "1"
+    assert records[-1].sql == "DROP TABLE t"
+    assert [record.id for record in records] == list(range(13))
+
+    parser = testparser.DTParser()
+    parser.get_file_name(str(test_file))
+    same_records(list(parser.iter_records()), records)
+
+
+def test_mysql_results(tmp_path):
+    (tmp_path / "t").mkdir()
+    (tmp_path / "r").mkdir()
+    (tmp_path / "t" / "a.test").write_text("--echo start\nSELECT 1;\nINSERT INTO t\nVALUES (1);\nSELECT a\nFROM t;\n--echo end\n")
+    (tmp_path / "r" / "a.result").write_text("start\nSELECT 1;\n1\n1\nINSERT INTO t\nVALUES (1);\nSELECT a\nFROM t;\na\n1\nend\n")
+    records = parse(testparser.MYTParser(), str(tmp_path / "t" / "a.test"))
+    assert [record.sql for record in records] == ["start", "SELECT 1;", "INSERT INTO t\nVALUES (1);", "SELECT a\nFROM t;", "end"]
+    assert [record.result for record in records[1:4]] == ["1\n1\n", "", "a\n1\n"]
+
+
+def test_split_psql_script():
+    script = ("SELECT 'a;b', E'c\\';d', $f$ ; $f$; -- e;\n"
+              "/* f /* g; */ */ CREATE FUNCTION h() RETURNS int BEGIN ATOMIC SELECT 1; END;\n"
+              "SELECT 1 AS one \\gset\n"
+              "COPY t FROM stdin;\n1;\t\\N\n\\.\n"
+              "\\if :one\nSELECT 2;\n\\endif\n"
+              "SELECT 3\\; SELECT 4;\n")
+    assert split_psql_script(script) == [
+        "SELECT 'a;b', E'c\\';d', $f$ ; $f$; -- e;",
+        "/* f /* g; */ */ CREATE FUNCTION h() RETURNS int BEGIN ATOMIC SELECT 1; END;",
+        "SELECT 1 AS one \\gset;",
+        "COPY t FROM stdin;",
+        "1;\t\\N\n\\.;",
+        "\\if :one\nSELECT 2;\n\\endif",
+        "SELECT 3\\; SELECT 4;"]
+
+
+SPLIT_FRAGMENTS = ["'a;b'", "'x'';y'", "$$x;y$$", "$t$ ; $$ $t$", "E'c\\';d'", "e'\\\\n;'", "/* c; */", "-- d;\n",
+                   "\"q;r\"", "\n", "x", "CASE WHEN 1 THEN 2 END", "(1, 2)", "/* a /* b; */ c */", ";", ";\n"]
+
+
+def test_split_like_sqlparse():
+    rand = random.Random(16)
+    for _ in range(2000):
+        script = "SELECT " + ' '.join(rand.choice(SPLIT_FRAGMENTS)
+                                      for _ in range(rand.randint(1, 12))) + ";\n"
+        assert split_psql_script(script) == [command.strip() for command in sqlparse.split(script)]
+    # sqlparse doesn't nest the comments, nor take \\ as an escaped backslash in E'' strings
+    assert split_psql_script("/* a /* b */ ; */ SELECT 1; SELECT E'\\\\'; SELECT ';';") == [
+        "/* a /* b */ ; */ SELECT 1;", "SELECT E'\\\\';", "SELECT ';';"]
+
+
+class OldAlignPGTParser(testparser.PGTParser):
+    """align the commands with the result lines as before, looking for the next command line by line
+    """
+
+    def parse_file_by_split(self):
+        commands = self.split_file()
+        commands = ['\n'.join(
+            [line for line in command.splitlines() if line]) for command in commands if command != ';']
+        pure_commands = [testparser.strip_dash_comment_lines(
+            command) for command in commands]
+        result_lines = [
+            line for line in self.result_content.splitlines() if line != '']
+        ind = 0
+        num_command = len(commands)
+        num_input = 0
+        for i, command in enumerate(commands):
+            result = ""
+            command_lines = [line.strip(';') for line in command.splitlines()]
+            for k in range(i, num_command):
+                next_command = commands[k + 1] if k < num_command - 1 else "\n"
+                if not next_command.endswith('\\.;'):
+                    break
+            next_line = next_command.splitlines()[0].strip(
+                ';') if next_command != ';' else ''
+            if command_lines[0] == result_lines[ind].strip(';'):
+                ind += len(command.split('\n'))
+            else:
+                self.records[i - 1 - num_input].input_data = command.strip(';')
+                num_input += 1
+                continue
+            if next_line == "":
+                result = '\n'.join(result_lines[ind: len(result_lines)])
+            elif result_lines[ind].strip(';') == next_line:
+                result = ""
+                if next_line == "--":
+                    if result_lines[ind + 1].strip(';') == "(1 row)":
+                        result = "--\n(1 row)\n"
+                        ind += 2
+            else:
+                for j in range(ind, len(result_lines)):
+                    if result_lines[j].strip(';') == next_line:
+                        result = '\n'.join(result_lines[ind:j])
+                        ind = j
+                        break
+            self.meta_data['total_testcase'] += 1
+            if re.match(r'^[\\]', command.strip()):
+                self.meta_data['psql_testcase'] += 1
+                if re.match(r'^[\\]quit', command.strip()):
+                    self.records.append(
+                        Control(id=i - num_input, sql=command.strip(';'), result=result))
+                else:
+                    self.records.append(
+                        Record(id=i - num_input, sql=command.strip(';'), result=result))
+            else:
+                self.records.append(Record(sql=testparser.strip_comment_suffix(
+                    pure_commands[i]).strip(';'), id=i - num_input, result=result))
+
+
+# the commands of a PostgreSQL test file and their echo with the output in the expected file
+PG_BLOCKS = [
+    ("CREATE TABLE t (a int);\n", "CREATE TABLE t (a int);\n"),
+    ("COPY t FROM stdin;\n1\n2\n\\.\n", "COPY t FROM stdin;\n"),
+    ("SELECT a FROM t;\n", "SELECT a FROM t;\n a \n---\n 1\n 2\n(2 rows)\n\n"),
+    ("-- the same line as a result\nSELECT a\n  FROM t;\n",
+     "-- the same line as a result\nSELECT a\n  FROM t;\n a \n---\n 1\n(1 row)\n\n"),
+    ("SELECT 1 AS one \\gset\n", "SELECT 1 AS one \\gset\n"),
+    ("SELECT 'x;y' AS s;\n", "SELECT 'x;y' AS s;\n  s  \n-----\n x;y\n(1 row)\n\n"),
+    ("SELECT '--' AS c;\n", "SELECT '--' AS c;\n c  \n----\n --\n(1 row)\n\n"),
+    ("SELECT * FROM missing;\n",
+     "SELECT * FROM missing;\nERROR:  relation \"missing\" does not exist\nLINE 1: SELECT * FROM missing;\n"
+     "                      ^\n"),
+    ("\\d t\n", "\\d t\n        Table \"public.t\"\n Column |  Type   \n--------+---------\n a      | integer\n\n"),
+]
+
+
+def test_align_results(tmp_path):
+    (tmp_path / "sql").mkdir()
+    (tmp_path / "expected").mkdir()
+    rand = random.Random(18)
+    for i in range(200):
+        # the last COPY data needs a command after it
+        blocks = [rand.choice(PG_BLOCKS) for _ in range(rand.randint(0, 15))] + [PG_BLOCKS[0]]
+        (tmp_path / "sql" / "a.sql").write_text(''.join(sql for sql, _ in blocks))
+        (tmp_path / "expected" / "a.out").write_text(''.join(out for _, out in blocks))
+        test_file = str(tmp_path / "sql" / "a.sql")
+        same_records(parse(testparser.PGTParser(), test_file), parse(OldAlignPGTParser(), test_file))
+
+
+def test_extract_manifest(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sqlite_tests").mkdir()
+    test_files = ["sqlite_tests/a.test", "sqlite_tests/b.test"]
+    for test_file in test_files:
+        (tmp_path / test_file).write_text("statement ok\nCREATE TABLE t1(a INTEGER)\n\nquery I nosort\nSELECT 1\n----\n1\n")
+    monkeypatch.setattr(extract_testcases, 'find_local_tests', lambda dbms_name: list(test_files))
+    outputs = [tmp_path / "data" / "sqlite" / (name + ".csv.zip") for name in ("a", "b")]
+
+    def extract(force=False):
+        capsys.readouterr()
+        extract_testcases.extract('sqlite', testparser.SLTParser(), force=force)
+        return capsys.readouterr().out.splitlines()[0]
+
+    def get_mtimes():
+        return [output.stat().st_mtime_ns for output in outputs]
+
+    assert extract() == "2 of 2 test files are new or changed"
+    mtimes = get_mtimes()
+    # the unchanged files are skipped
+    assert extract() == "0 of 2 test files are new or changed"
+    assert get_mtimes() == mtimes
+    (tmp_path / test_files[1]).write_text("query I nosort\nSELECT 2\n----\n2\n")
+    assert extract() == "1 of 2 test files are new or changed"
+    new_mtimes = get_mtimes()
+    assert new_mtimes[0] == mtimes[0] and new_mtimes[1] != mtimes[1]
+    assert len(pd.read_csv(outputs[1], compression='zip')) == 1
+    # --force extracts them all again
+    assert extract(force=True) == "2 of 2 test files are new or changed"
+    assert get_mtimes()[0] != new_mtimes[0]
+    # the output of a deleted test file is pruned
+    test_files.pop()
+    assert extract() == "prune data/sqlite/b.csv.zip"
+    assert not outputs[1].exists()
+
+
+def test_extract_manifest_dump_error(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sqlite_tests").mkdir()
+    test_file = tmp_path / "sqlite_tests" / "a.test"
+    test_file.write_text("query I nosort\nSELECT 1\n----\n1\n")
+    monkeypatch.setattr(extract_testcases, 'find_local_tests', lambda dbms_name: ["sqlite_tests/a.test"])
+    output = tmp_path / "data" / "sqlite" / "a.csv.zip"
+    extract_testcases.extract('sqlite', testparser.SLTParser())
+    assert len(pd.read_csv(output, compression='zip')) == 1
+
+    # the changed file fails to dump, its old output is not taken as up to date
+    test_file.write_text("query I nosort\nSELECT 1\n----\n1\n\nquery I nosort\nSELECT 2\n----\n2\n")
+
+    def failed_dump(self):
+        raise OSError("disk full")
+    with monkeypatch.context() as m:
+        m.setattr(testcollector.TestcaseCollector, 'dump', failed_dump)
+        extract_testcases.extract('sqlite', testparser.SLTParser())
+    assert "failed to dump sqlite_tests/a.test disk full" in capsys.readouterr().out
+    extract_testcases.extract('sqlite', testparser.SLTParser())
+    assert capsys.readouterr().out.splitlines()[0] == "1 of 1 test files are new or changed"
+    assert len(pd.read_csv(output, compression='zip')) == 2
@@ -1,10 +1,29 @@
 from os import listdir
 from src import testrunner
+from src import testparser
+from src.prefixsnapshot import PrefixSnapshots
+from src.watchdog import QueryWatchdog
+from src import mysqlpool
+from src import bugdumper
+from src.bugdumper import BugDumper
+from src.checkpoint import Checkpoint
+from datetime import datetime
+from decimal import Decimal
+from src.utils import OUTPUT_PATH, PhaseTimer, TimingColumns, read_results_csv
+from src.utils import ResultHelper, ResultHasher, ColumnarResult
+import csv
+import duckdb
+import os
 import pandas as pd
+import random
+import sqlite3
 import sys
+import threading
+import time
 
-from src.utils import Query, Statement, Control, RunnerAction, SortType, ResultFormat
+from src.utils import Query, Statement, Control, RunnerAction, SortType, ResultFormat, ResultColumns
 import logging
+import main
 
 
 
@@ -45,3 +64,800 @@ def test_run_test(tmp_path, caplog):
         runner.run()
         runner.dump()
     # assert 0
+
+
+def test_query_timeout(tmp_path):
+    runner = testrunner.SQLiteRunner()
+    runner.MAX_RUNTIME_PERSQL = 0.2
+    runner.init_dumper(write_files=False)
+    runner.init_filter()
+    endless = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+    records = [Query(sql=endless, result="1", data_type="I", id=0),
+               Query(sql="SELECT 1", result="1", data_type="I", id=1)]
+    db_path = str(tmp_path / "tempdb")
+    runner.set_db(db_path)
+    runner.get_records(records, 0, "timeout.test")
+    runner.connect(db_path)
+    runner.run()
+    runner.close()
+    error_msg = ResultColumns.index('ERROR_MSG')
+    assert runner.bug_dumper.bugs_rows[0][error_msg] == "Time Exceed - 0.2"
+    # the connection is still usable after the interruption
+    assert runner.single_run_stats['success_query_num'] == 1
+
+
+def test_watchdog_slow_cancel():
+    # the SQL running on the connection, and the ones that the cancel killed
+    running = []
+    killed = []
+
+    def slow_cancel():
+        # e.g. the MySQL KILL QUERY that waits for its connection
+        time.sleep(0.5)
+        killed.extend(running)
+    watchdog = QueryWatchdog(slow_cancel)
+    watchdog.CANCEL_WAIT = 0.1
+    watchdog.arm(0.05)
+    running.append("slow")
+    time.sleep(0.2)
+    # the slow SQL ends before the cancel reaches the server
+    running.clear()
+    assert watchdog.disarm()
+    # the next SQL only runs once the cancel is done, so it is not killed
+    watchdog.arm(10)
+    running.append("next")
+    time.sleep(0.6)
+    running.clear()
+    assert not watchdog.disarm()
+    assert killed == []
+
+
+def test_row_wise_early_exit():
+    runner = testrunner.DuckDBRunner()
+    runner.init_dumper(write_files=False)
+    runner.init_filter()
+    records = [Query(sql="SELECT range, range % 2 = 0 FROM range(3)", result="0\tTrue\n1\tFalse\n2\tTrue",
+                     data_type="II", id=0, res_format=ResultFormat.ROW_WISE),
+               Query(sql="SELECT range FROM range(100000000000)", result="0",
+                     data_type="I", id=1, res_format=ResultFormat.ROW_WISE)]
+    runner.set_db(":memory:")
+    runner.get_records(records, 0, "row_wise.test")
+    runner.connect(":memory:")
+    runner.run()
+    runner.close()
+    assert runner.single_run_stats['wrong_query_num'] == 1
+    actual_result = runner.bug_dumper.bugs_rows[0][ResultColumns.index('ACTUAL_RESULT')]
+    assert actual_result.endswith('\n...')
+    assert actual_result.count('\n') <= runner.MAX_ACTUAL_ROWS
+
+
+def test_prefix_snapshot(tmp_path):
+    runner = testrunner.SQLiteRunner()
+    runner.init_dumper(write_files=False)
+    runner.init_filter()
+    prefix = ["CREATE TABLE t1(a INTEGER)"] + \
+        ["INSERT INTO t1 VALUES(%d)" % i for i in range(5)]
+    files = {}
+    for name, extra in [("a.test", "INSERT INTO t1 VALUES(5)"), ("b.test", "INSERT INTO t1 VALUES(6)"),
+                        ("c.test", "CREATE TABLE t2(b INTEGER)")]:
+        files[name] = [Statement(sql=sql, id=i) for i, sql in enumerate(prefix[:5 if name == "c.test" else 6] + [extra])] + \
+            [Query(sql="SELECT count(*) FROM t1", result="6", data_type="I", id=10)]
+    # c.test diverges after the first 5 statements, a.test and b.test share 6 of them
+    files["c.test"][-1].result = "4"
+
+    prefixes = PrefixSnapshots(runner.dbms_name)
+    for name, records in files.items():
+        prefixes.add_file(name, records)
+    prefixes.plan()
+    db_path = str(tmp_path / "tempdb")
+    prefixes.bind(runner, db_path)
+    assert [prefixes.get(name)[1] for name in files] == [6, 6, 5]
+
+    for i, (name, records) in enumerate(files.items()):
+        runner.set_prefix_snapshot(*prefixes.get(name))
+        runner.set_db(db_path)
+        runner.get_records(records, i, name)
+        runner.connect(db_path)
+        runner.run()
+        runner.close()
+        assert runner.single_run_stats['statement_num'] == len(records) - 1
+        assert runner.single_run_stats['success_query_num'] == 1
+        assert runner.allright
+    prefixes.drop_all(runner, db_path)
+
+
+def test_prefix_snapshot_fallback(tmp_path):
+    for runner in (testrunner.PSQLRunner(), testrunner.MySQLRunner(), testrunner.CockroachDBRunner()):
+        assert not runner.supports_prefix_snapshot("db")
+    # a runner without snapshots runs the prefix as usual
+    runner = testrunner.MySQLRunner()
+    records = [Statement(sql="CREATE TABLE t1(a INTEGER)", id=0), Statement(sql="INSERT INTO t1 VALUES(1)", id=1)]
+    prefixes = PrefixSnapshots(runner.dbms_name)
+    for name in ("a.test", "b.test"):
+        prefixes.add_file(name, records)
+    prefixes.plan()
+    prefixes.bind(runner, "db")
+    assert prefixes.get("a.test") == (None, 0)
+
+    # the WAL left by the last file is not replayed over the snapshot
+    runner = testrunner.DuckDBRunner()
+    snapshot, db_path = str(tmp_path / "snapshot"), str(tmp_path / "tempdb")
+    runner.build_snapshot(snapshot, None, [record.sql for record in records])
+    con = duckdb.connect(db_path)
+    con.execute("CREATE TABLE stale(a INTEGER)")
+    con.close()
+    with open(db_path + ".wal", "w") as f:
+        f.write("stale")
+    runner.set_prefix_snapshot(snapshot, 2)
+    runner.set_db(db_path)
+    assert not os.path.exists(db_path + ".wal")
+    runner.connect(db_path)
+    assert runner.execute_query("SELECT count(*) FROM t1") == [(1, )]
+    runner.close()
+
+
+def test_batch(tmp_path):
+    sqls = ["CREATE TABLE t1(a INTEGER PRIMARY KEY)"] + ["INSERT INTO t1 VALUES(%d)" % (i % 7) for i in range(10)]
+    records = [Statement(sql=sql, id=i) for i, sql in enumerate(sqls)] + \
+        [Statement(sql="INSERT INTO t1 VALUES(0)", status=False, id=11),
+         Query(sql="SELECT count(*) FROM t1", result="7", data_type="I", id=12)]
+    runs = []
+    for runner_class in (testrunner.SQLiteRunner, testrunner.DuckDBRunner):
+        for batch_size in (0, 4):
+            runner = runner_class()
+            runner.init_dumper(dump_all=True, write_files=False)
+            runner.init_filter()
+            runner.set_batch(batch_size)
+            db_path = str(tmp_path / ("%s%d" % (runner.dbms_name, batch_size)))
+            runner.set_db(db_path)
+            runner.get_records(records, 0, "batch.test")
+            runner.connect(db_path)
+            runner.run()
+            runner.close()
+            # the duplicated keys fail in their batch, and are reported as without it
+            assert runner.single_run_stats['wrong_stmt_num'] == 3
+            assert runner.single_run_stats['success_query_num'] == 1
+            assert runner.single_run_stats['wrong_query_num'] == 0
+            runs.append((runner.single_run_stats, [
+                (row[ResultColumns.index('TESTCASE_INDEX')], row[ResultColumns.index('IS_ERROR')])
+                for row in runner.bug_dumper.bugs_rows]))
+    assert runs[0] == runs[1] and runs[2] == runs[3]
+
+
+# a stand-in for psql reading commands from stdin: it runs a statement at ';' or at a meta-command,
+# writes the messages to stderr with their location, and echoes the input lines with -a
+FAKE_PSQL = r"""
+import sqlite3
+import sys
+echo_all = '-a' in sys.argv
+buffer = ''
+for n, line in enumerate(sys.stdin, 1):
+    if echo_all:
+        print(line, end='', flush=True)
+    line = line.rstrip('\n')
+    if line.startswith('\\echo '):
+        print(line[6:], flush=True)
+        continue
+    if line == 'exit;':
+        sys.exit(2)
+    buffer += line + '\n'
+    if not line.endswith(';') and '\\g' not in line:
+        continue
+    if line.endswith('\\gset;'):
+        sys.stderr.write('psql:<stdin>:%d: error: invalid variable name: ";"\n' % n)
+    elif 'raise_error' in buffer:
+        sys.stderr.write('psql:<stdin>:%d: ERROR:  boom\n' % n)
+    elif 'raise_notice' in buffer:
+        sys.stderr.write('psql:<stdin>:%d: NOTICE:  hello\n' % n)
+    if buffer.startswith('SELECT') and '\\gset' not in buffer and 'raise_error' not in buffer:
+        print(' a \n---\n 1\n 2\n(2 rows)\n', flush=True)
+    buffer = ''
+"""
+
+
+def test_psql_coprocess(tmp_path):
+    fake_psql = tmp_path / "psql.py"
+    fake_psql.write_text(FAKE_PSQL)
+    runner = testrunner.PSQLRunner()
+    runner.cmd = [sys.executable, str(fake_psql)]
+    coprocess = runner.get_coprocess()
+    # each output is framed by the delimiter, and the multi-line statement gets its ';'
+    assert coprocess.execute("CREATE TABLE t(a int)") == ""
+    assert coprocess.execute("SELECT a\nFROM t") == " a \n---\n 1\n 2\n(2 rows)\n\n"
+    assert runner.execute_query("SELECT a FROM t;") == "1\n2"
+    # the meta-command sends the statement, it must not be followed by ';'
+    assert coprocess.execute("SELECT 1 AS one \\gset") == ""
+    # the notices are not errors, and the location prefix of psql is dropped
+    runner.execute_stmt("SELECT raise_notice()")
+    assert coprocess.execute("DO raise_notice") == "NOTICE:  hello\n"
+    for execute in (runner.execute_stmt, runner.execute_query):
+        try:
+            execute("SELECT raise_error()")
+        except testrunner.DBEngineExcetion as e:
+            assert "ERROR:  boom" in str(e)
+        else:
+            assert False, "the error is not raised"
+    # psql is started again once it exits
+    pid = coprocess.proc.pid
+    try:
+        coprocess.execute("exit")
+    except testrunner.DBEngineExcetion:
+        pass
+    else:
+        assert False, "the exit is not raised"
+    assert coprocess.execute("CREATE TABLE t2(a int)") == ""
+    assert coprocess.proc.pid != pid
+    runner.close_coprocess(runner.cmd)
+    assert not runner.coprocesses
+
+    # psql -a echoes the commands, they are not a part of the output
+    runner.cmd = [sys.executable, str(fake_psql), '-a']
+    assert runner.execute_query("SELECT a\nFROM t") == "1\n2"
+    runner.close_coprocess(runner.cmd)
+
+
+class FakeMySQLCursor():
+    def __init__(self, con):
+        self.con = con
+
+    def execute(self, sql):
+        server = self.con.server
+        server['log'].append(sql)
+        if sql in server['failures']:
+            server['failures'].remove(sql)
+            raise RuntimeError("lost %s" % sql)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeMySQLConnection():
+    def __init__(self, server):
+        self.server = server
+        self.connection_id = len(server['connections'])
+        self.connected = True
+        self.reset_error = None
+        server['connections'].append(self)
+
+    def cursor(self):
+        return FakeMySQLCursor(self)
+
+    def is_connected(self):
+        return self.connected
+
+    def consume_results(self):
+        pass
+
+    def reset_session(self):
+        if self.reset_error is not None:
+            raise self.reset_error
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.connected = False
+
+
+def fake_mysql_server(monkeypatch):
+    server = {'log': [], 'connections': [], 'failures': []}
+    monkeypatch.setattr(mysqlpool.mysql.connector, 'connect', lambda **config: FakeMySQLConnection(server))
+    monkeypatch.setattr(mysqlpool, 'POOLS', {})
+    return server
+
+
+def test_mysql_connection_pool(monkeypatch):
+    server = fake_mysql_server(monkeypatch)
+    pool = mysqlpool.get_connection_pool("localhost", 3306, "root", "root")
+    assert mysqlpool.get_connection_pool("localhost", 3306, "root", "root") is pool
+    assert mysqlpool.get_connection_pool("localhost", 3307, "root", "root") is not pool
+    con1, con2 = pool.get_connection(), pool.get_connection()
+    pool.release(con1)
+    assert pool.get_connection() is con1
+    # a connection that could not be reset is closed instead of kept
+    con2.reset_error = mysqlpool.mysql.connector.InterfaceError("broken")
+    pool.release(con2)
+    assert not con2.connected and pool.idle == []
+    # nor is a connection closed by the server handed out
+    pool.release(con1)
+    con1.connected = False
+    con3 = pool.get_connection()
+    assert con3 is not con1 and len(server['connections']) == 3
+
+
+def test_mysql_scratch_databases(monkeypatch):
+    server = fake_mysql_server(monkeypatch)
+    pool = mysqlpool.get_connection_pool("localhost", 3306, "root", "root")
+    # the first CREATE fails with an unexpected error, which must not stop the thread
+    server['failures'].append("CREATE DATABASE db_scratch0")
+    databases = mysqlpool.ScratchDatabases(pool, "db")
+    databases.TIMEOUT = 5
+    names = []
+    for _ in range(3):
+        try:
+            names.append(databases.get())
+        except RuntimeError:
+            names.append(None)
+    assert names[0] is None and sorted(names[1:]) == ["db_scratch0", "db_scratch1"]
+    # a used database is recreated before it is handed out again
+    databases.recycle(names[2])
+    assert databases.get() == names[2]
+    assert server['log'][-2:] == ["DROP DATABASE IF EXISTS %s" % names[2], "CREATE DATABASE %s" % names[2]]
+
+    # both databases are in use
+    databases.TIMEOUT = 0.1
+    try:
+        databases.get()
+    except TimeoutError:
+        pass
+    else:
+        assert False, "get() waits for a clean database forever"
+
+
+def test_mysql_runner_pool(monkeypatch):
+    server = fake_mysql_server(monkeypatch)
+    runner = testrunner.MySQLRunner()
+    for i in range(3):
+        runner.set_db("squality")
+        runner.connect("squality")
+        assert server['log'][-1] == "USE %s" % runner.scratch_db
+        runner.close()
+        if i != 1:
+            runner.remove_db("squality")
+    # the files share one connection, and the recycler has its own
+    assert len(server['connections']) == 2
+    assert runner.pool.idle == [server['connections'][1]]
+
+
+def use_output_dir(monkeypatch, tmp_path):
+    for key in ('execution_result', 'execution_log', 'execution_timing', 'checkpoint'):
+        monkeypatch.setitem(OUTPUT_PATH, key, str(tmp_path / OUTPUT_PATH[key].split('/')[-1]))
+    monkeypatch.setitem(OUTPUT_PATH, 'base', str(tmp_path))
+
+
+def save_file_state(dumper: BugDumper, index: int):
+    """dump a test file whose every third statement fails, and whose failures share their logs in pairs
+    """
+    dumper.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+    dumper.reset_schema()
+    logs = []
+    for i in range(10):
+        record = Statement(sql="INSERT INTO t VALUES(%d, 'a,\"b\"\nc')" % i, id=i)
+        if i % 3 == 2:
+            dumper.save_state(logs[:i // 2], record, "False", 0, is_error=True, msg="error %d" % i)
+        else:
+            dumper.save_state(logs, record, "True", 0)
+            logs.append(record)
+
+
+def read_dumped(results_path: str, logs_path: str):
+    """read the results with their logs, without the date"""
+    with open(logs_path, newline='', encoding='utf-8') as f:
+        logs = [row[0] for row in list(csv.reader(f))[1:]]
+    with open(results_path, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    date, logs_index, is_error = (rows[0].index(name) for name in ('DATE', 'LOGS_INDEX', 'IS_ERROR'))
+    return [row[:date] + row[date + 1:] + [logs[int(row[logs_index])] if row[is_error] == 'True' else None]
+            for row in rows[1:]]
+
+
+def test_worker_parts(monkeypatch, tmp_path):
+    use_output_dir(monkeypatch, tmp_path)
+    monkeypatch.setattr(BugDumper, 'BATCH_SIZE', 4)
+    dumper = BugDumper("sqlite", True)
+    for index in range(3):
+        save_file_state(dumper, index)
+        dumper.dump_to_csv("sqlite")
+    expected = read_dumped(dumper.results_path, dumper.logs_path)
+
+    # two workers dump the files to their parts, the second one ran another file before
+    part_dir = tmp_path / "parts"
+    part_dir.mkdir()
+    workers = [BugDumper("sqlite", True, part_dir=str(part_dir)) for _ in range(2)]
+    save_file_state(workers[1], 7)
+    workers[1].flush("sqlite")
+    parent = BugDumper("sqlite", True, suffix="_jobs")
+    for index in range(3):
+        worker = workers[index % 2]
+        log_base = worker.log_index
+        save_file_state(worker, index)
+        worker.flush("sqlite")
+        parent.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+        parent.merge_part(str(part_dir), index, log_base, worker.log_index - log_base)
+        parent.dump_to_csv("sqlite")
+    assert read_dumped(parent.results_path, parent.logs_path) == expected
+    assert sorted(p.name for p in part_dir.iterdir()) == ["7_logs.csv", "7_results.csv"]
+
+
+
+def save_error_state(dumper: BugDumper, index: int, log_sql: str):
+    """dump a test file of a single failed statement after the log_sql"""
+    dumper.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+    dumper.reset_schema()
+    dumper.save_state([Statement(sql=log_sql, id=0)], Statement(sql="SELECT x FROM a", id=1),
+                      "False", 0, is_error=True, msg="error")
+
+
+def test_worker_parts_shared_log(monkeypatch, tmp_path):
+    use_output_dir(monkeypatch, tmp_path)
+    part_dir = tmp_path / "parts"
+    part_dir.mkdir()
+    workers = [BugDumper("sqlite", True, part_dir=str(part_dir)) for _ in range(2)]
+    parent = BugDumper("sqlite", True)
+    # the first worker runs two files that fail after the same log, the other one's file is merged between them
+    files = [(0, workers[0], "CREATE TABLE a(x)"), (1, workers[1], "CREATE TABLE b(x)"),
+             (2, workers[0], "CREATE TABLE a(x)")]
+    for index, worker, log_sql in files:
+        log_base = worker.log_index
+        save_error_state(worker, index, log_sql)
+        worker.flush("sqlite")
+        parent.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+        parent.merge_part(str(part_dir), index, log_base, worker.log_index - log_base)
+        parent.dump_to_csv("sqlite")
+    assert [row[-1] for row in read_dumped(parent.results_path, parent.logs_path)] == \
+        [log_sql for _, _, log_sql in files]
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 2, 3, 4)
+
+
+def dump_row_by_row(results_path: str, logs_path: str, files: list):
+    """dump the test files as BugDumper did before the batches, one DataFrame row per test case
+    """
+    pd.DataFrame(columns=ResultColumns).to_csv(results_path, mode='w', header=True)
+    pd.DataFrame(columns=['LOGS']).to_csv(logs_path, mode='w', header=True, index=False)
+    log_index = 0
+    last_log = None
+    for index, states in files:
+        bugs, logs = [], []
+        for log_list, record, result, is_error, msg in states:
+            temp_log = ";\n".join([log.sql for log in log_list])
+            if is_error and temp_log != last_log:
+                log_index += 1
+                last_log = temp_log
+                logs.append({'LOGS': temp_log})
+            bugs.append(dict(zip(ResultColumns, (
+                "sqlite", index, "t%d.test" % index, None, record.id, record.sql, type(record).__name__,
+                record.result, result.strip(), 0, "24-01-02-03:04", str(is_error), msg, log_index - 1, 0, 0, 0))))
+        pd.DataFrame(bugs, columns=ResultColumns).to_csv(results_path, mode='a', header=False)
+        pd.DataFrame(logs, columns=['LOGS']).to_csv(logs_path, mode='a', header=False, index=False)
+
+
+def file_states(index: int):
+    """the save_state calls of a test file, whose every third statement fails"""
+    states, logs = [], []
+    for i in range(10):
+        record = Statement(sql="INSERT INTO t%d VALUES(%d, 'a,\"b\"\nc')" % (index, i), id=i)
+        if i % 3 == 2:
+            states.append((logs[:i // 2], record, "False", True, "error %d" % i))
+        else:
+            states.append((list(logs), record, " True\n", False, ""))
+            logs.append(record)
+    return states
+
+
+def test_batched_dump(monkeypatch, tmp_path):
+    use_output_dir(monkeypatch, tmp_path)
+    monkeypatch.setattr(bugdumper, 'datetime', FixedDatetime)
+    files = [(index, file_states(index)) for index in range(4)]
+    expected_results, expected_logs = str(tmp_path / "old_results.csv"), str(tmp_path / "old_logs.csv")
+    dump_row_by_row(expected_results, expected_logs, files)
+
+    # flush by the number of rows, then by their size, and merge the last file from a worker part
+    monkeypatch.setattr(BugDumper, 'BATCH_SIZE', 3)
+    dumper = BugDumper("sqlite", True)
+    part_dir = tmp_path / "parts"
+    part_dir.mkdir()
+    worker = BugDumper("sqlite", True, part_dir=str(part_dir))
+    worker.log_index = 5
+    for index, states in files:
+        if index == 2:
+            dumper.MAX_BUFFER_SIZE = 100
+        target = worker if index == 3 else dumper
+        target.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+        target.reset_schema()
+        log_base = target.log_index
+        for logs, record, result, is_error, msg in states:
+            target.save_state(logs, record, result, 0, is_error=is_error, msg=msg)
+        if target is worker:
+            worker.flush("sqlite")
+            dumper.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+            dumper.merge_part(str(part_dir), index, log_base, worker.log_index - log_base)
+        dumper.dump_to_csv("sqlite")
+    for path, expected_path in ((dumper.results_path, expected_results), (dumper.logs_path, expected_logs)):
+        with open(path, encoding='utf-8') as f, open(expected_path, encoding='utf-8') as expected:
+            assert f.read() == expected.read()
+
+
+def run_dumped_files(dumper: BugDumper, checkpoint: Checkpoint, indexes):
+    for index in indexes:
+        dumper.get_testfile_data(testfile_index=index, testfile_path="t%d.test" % index)
+        dumper.reset_schema()
+        for logs, record, result, is_error, msg in file_states(index):
+            dumper.save_state(logs, record, result, 0, is_error=is_error, msg=msg)
+        dumper.dump_to_csv("sqlite")
+        checkpoint.add(index, "t%d.test" % index, {'total_executed_sql': 10},
+                       dumper.get_output_paths(), dumper.log_index)
+
+
+def test_checkpoint_resume(monkeypatch, tmp_path):
+    use_output_dir(monkeypatch, tmp_path)
+    monkeypatch.setattr(bugdumper, 'datetime', FixedDatetime)
+    monkeypatch.setattr(BugDumper, 'BATCH_SIZE', 4)
+    dumper = BugDumper("sqlite", True)
+    checkpoint = Checkpoint("sqlite")
+    checkpoint.reset()
+    run_dumped_files(dumper, checkpoint, range(4))
+    expected = [open(path, encoding='utf-8').read() for path in dumper.get_output_paths()[:2]]
+
+    # the run is killed while the third file is dumped, and while its checkpoint line is written
+    dumper = BugDumper("sqlite", True)
+    checkpoint.reset()
+    run_dumped_files(dumper, checkpoint, range(2))
+    dumper.get_testfile_data(testfile_index=2, testfile_path="t2.test")
+    dumper.reset_schema()
+    for logs, record, result, is_error, msg in file_states(2)[:6]:
+        dumper.save_state(logs, record, result, 0, is_error=is_error, msg=msg)
+    with open(checkpoint.path, 'a', encoding='utf-8') as f:
+        f.write('{"index": 2, "path": "t2.test", "sta')
+
+    # resume from the last complete line
+    dumper = BugDumper("sqlite", True, resume=True)
+    checkpoint = Checkpoint("sqlite")
+    assert checkpoint.load()
+    assert sorted(checkpoint.finished) == [0, 1]
+    assert checkpoint.get_stats()['total_executed_sql'] == 20
+    dumper.resume(checkpoint.last_entry['offsets'], checkpoint.last_entry['log_index'])
+    run_dumped_files(dumper, checkpoint, [i for i in range(4) if not checkpoint.is_finished(i, "t%d.test" % i)])
+    assert [open(path, encoding='utf-8').read() for path in dumper.get_output_paths()[:2]] == expected
+    # a later resume still sees every finished file
+    checkpoint = Checkpoint("sqlite")
+    checkpoint.load()
+    assert sorted(checkpoint.finished) == [0, 1, 2, 3]
+
+
+def test_phase_times(monkeypatch, tmp_path):
+    timer = PhaseTimer()
+    timer.start_record()
+    # a phase inside another one is counted as the outer one
+    with timer.phase('connect'):
+        with timer.phase('execute'):
+            time.sleep(0.01)
+    with timer.phase('execute'):
+        time.sleep(0.01)
+    assert timer.file_times['connect'] >= 10 ** 7 and timer.file_times['execute'] >= 10 ** 7
+    assert timer.record_times['execute'] == timer.file_times['execute']
+    assert timer.get_exec_time() == timer.record_times['execute'] // 1000
+
+    use_output_dir(monkeypatch, tmp_path)
+    runner = testrunner.SQLiteRunner()
+    runner.init_filter()
+    runner.init_dumper(dump_all=True)
+    records = [Statement(sql="CREATE TABLE t1(a INTEGER)", id=0),
+               Query(sql="SELECT count(*) FROM t1", result="0", data_type="I", id=1)]
+    runner.set_db(":memory:")
+    runner.get_records(records, 0, "timing.test")
+    runner.connect(":memory:")
+    runner.run()
+    runner.close()
+    runner.dump()
+    results = read_results_csv(runner.bug_dumper.results_path)
+    assert list(results.columns[1:]) == ResultColumns
+    for column in ('EXECUTE_NS', 'FETCH_NS', 'COMPARE_NS'):
+        assert (results[column] >= 0).all()
+    assert (results['EXECUTE_NS'] > 0).all() and results['COMPARE_NS'][1] > 0
+    timing = pd.read_csv(runner.bug_dumper.timing_path)
+    assert list(timing.columns) == TimingColumns and len(timing) == 1
+    phases = timing.iloc[0]
+    assert phases['TOTAL_NS'] >= sum(phases[column] for column in TimingColumns[2:-1]) > 0
+
+    # the results written before the phase times are read with 0 for them
+    old_path = tmp_path / "old_results.csv"
+    results.drop(columns=['EXECUTE_NS', 'FETCH_NS', 'COMPARE_NS']).to_csv(old_path, index=False)
+    old_results = read_results_csv(str(old_path))
+    assert set(ResultColumns) <= set(old_results.columns)
+    assert (old_results['EXECUTE_NS'] == 0).all()
+
+
+class OldResultHelper(ResultHelper):
+    """the value-wise formatting and sorting of the results before they went column by column
+    """
+
+    def format_results(self, results, datatype: str):
+        format_func = {'I': self.int_format,
+                       'R': self.float_format, 'T': self.text_format}
+        return [[format_func[col](item) for col, item in zip(datatype, row)] for row in results]
+
+    def sort_result(self, results, sort_type=SortType.ROW_SORT):
+        result_flat = []
+        if sort_type == SortType.ROW_SORT:
+            results = [list(map(str, row)) for row in results]
+            results.sort()
+            for row in results:
+                for item in row:
+                    result_flat.append(item + '\n')
+        elif sort_type == SortType.VALUE_SORT:
+            for row in results:
+                for item in row:
+                    result_flat.append(str(item) + '\n')
+            result_flat.sort()
+        else:
+            for row in results:
+                for item in row:
+                    result_flat.append(str(item) + '\n')
+        return ''.join(result_flat)
+
+    def value_wise_compare(self, results, record, hash_threshold, is_hash=True):
+        result_string = ""
+        if results:
+            result_len = len(results) * len(results[0])
+            result_string = self.sort_result(self.format_results(
+                results, record.data_type), sort_type=record.sort)
+        else:
+            result_len = 0
+        if is_hash and result_len > hash_threshold:
+            result_string = str(result_len) + " values hashing to " + \
+                self.hash_results(result_string)
+        return result_string.strip() == record.result.strip(), result_string
+
+    def hash_compare(self, results, record):
+        result_string = self.hash_results('\n'.join(['\n'.join(
+            [str(item) if item != None else 'NULL' for item in row]) for row in results]) + '\n')
+        return record.result.find(result_string) != -1, result_string
+
+
+RANDOM_ITEMS = [
+    lambda rand: rand.randint(-1000, 1000),
+    lambda rand: rand.randint(-10, 10) * 10 ** 20,
+    lambda rand: rand.uniform(-1000, 1000),
+    lambda rand: float(rand.randint(-5, 5)),
+    lambda rand: Decimal(rand.randint(-10 ** 6, 10 ** 6)) / 1000,
+    lambda rand: str(rand.randint(-99, 99)),
+    lambda rand: "%.4f" % rand.uniform(-10, 10),
+    lambda rand: rand.choice(['', 'abc', 'a b', 'NULL', 'x\ty', '1e3', 'inf', 'été']),
+    lambda rand: rand.choice([True, False]),
+    lambda rand: None,
+]
+
+
+def random_rows(rand: random.Random, row_num: int, width: int, ragged=False):
+    """random rows with items of mixed types, a column keeps mostly one kind of items
+    """
+    kinds = [rand.randrange(len(RANDOM_ITEMS)) for _ in range(width)]
+    rows = []
+    for _ in range(row_num):
+        row = tuple(RANDOM_ITEMS[kind if rand.random() < 0.8 else rand.randrange(len(RANDOM_ITEMS))](rand)
+                    for kind in kinds)
+        if ragged and rand.random() < 0.2:
+            row = row[:rand.randrange(width + 1)]
+        rows.append(row)
+    return rows
+
+
+def random_query(rand: random.Random, width: int, res_format=ResultFormat.VALUE_WISE):
+    return Query(sql="SELECT 1", data_type=''.join(rand.choice('IRT') for _ in range(width)),
+                 sort=rand.choice(list(SortType)), res_format=res_format, id=0)
+
+
+def test_format_columns():
+    rand = random.Random(9)
+    for i in range(300):
+        width = rand.randint(1, 4)
+        record = random_query(rand, width)
+        rows = random_rows(rand, rand.randint(0, 30), width, ragged=i % 5 == 0)
+        old_string = OldResultHelper(rows, record).value_wise_compare(rows, record, 10 ** 9)[1]
+        record.result = old_string
+        assert ResultHelper(rows, record).value_wise_compare(rows, record, 10 ** 9) == (True, old_string)
+        # and the hashed strings
+        old_hashed = OldResultHelper(rows, record).value_wise_compare(rows, record, 0)[1]
+        assert ResultHelper(rows, record).value_wise_compare(rows, record, 0)[1] == old_hashed
+        if rows and len(set(map(len, rows))) == 1:
+            helper = ResultHelper(rows, record)
+            columns = helper.format_columns(rows, record.data_type)
+            assert [list(row) for row in zip(*columns)] == \
+                OldResultHelper(rows, record).format_results(rows, record.data_type)
+            assert helper.join_columns(columns, record.sort) == \
+                OldResultHelper(rows, record).sort_result(
+                    OldResultHelper(rows, record).format_results(rows, record.data_type), record.sort)
+
+
+def feed_hasher(hasher: ResultHasher, rand: random.Random, rows: list, columnar=False):
+    """feed the rows in random batches, as rows or as columns
+    """
+    begin = 0
+    while begin < len(rows):
+        end = begin + rand.randint(1, 40)
+        if columnar:
+            hasher.update_columns([list(column) for column in zip(*rows[begin:end])])
+        else:
+            hasher.update(rows[begin:end])
+        begin = end
+    return hasher.finish()
+
+
+def test_result_hasher(monkeypatch):
+    # spill every batch, in runs of a few blocks
+    monkeypatch.setattr(ResultHasher, 'SPILL_BLOCK', 7)
+    rand = random.Random(10)
+    for i in range(300):
+        width = rand.randint(1, 4)
+        res_format = ResultFormat.HASH if i % 4 == 0 else ResultFormat.VALUE_WISE
+        record = random_query(rand, width, res_format)
+        rows = random_rows(rand, rand.randint(0, 200), width, ragged=i % 6 == 1)
+        hash_threshold = rand.choice([0, 8, 100, 10 ** 9])
+        old_helper = OldResultHelper(rows, record)
+        if res_format == ResultFormat.HASH:
+            old_string = old_helper.hash_compare(rows, record)[1]
+            record.result = "%d values hashing to %s" % (len(rows), old_string)
+        else:
+            old_string = old_helper.value_wise_compare(rows, record, hash_threshold)[1]
+            record.result = old_string
+        memory_limit = rand.choice([1, 500, 10 ** 9])
+        hasher = ResultHasher(record, hash_threshold, memory_limit)
+        assert feed_hasher(hasher, rand, rows) == (True, old_string)
+        if memory_limit == 1 and len(rows) > 40 and record.sort != SortType.NO_SORT and \
+                res_format == ResultFormat.VALUE_WISE:
+            assert len(hasher.runs) > 1
+        if rows and len(set(map(len, rows))) == 1:
+            hasher = ResultHasher(record, hash_threshold, memory_limit)
+            assert feed_hasher(hasher, rand, rows, columnar=True) == (True, old_string)
+
+
+def test_columnar_result():
+    runner = testrunner.DuckDBRunner()
+    runner.init_dumper(write_files=False)
+    runner.init_filter()
+    runner.set_db(":memory:")
+    runner.connect(":memory:")
+    runner.con.execute("""CREATE TABLE t AS SELECT range AS i, range * 1000000000000 AS b,
+        CASE WHEN range % 7 = 0 THEN NULL ELSE range / 3 END AS d, CAST(range AS REAL) / 8 AS f,
+        CASE WHEN range % 5 = 0 THEN NULL ELSE 'v' || (range % 13) END AS s, range % 2 = 0 AS bool,
+        CAST(range % 200 - 100 AS TINYINT) AS ti FROM range(500)""")
+    rand = random.Random(12)
+    columns = ['i', 'b', 'd', 'f', 's', 'bool', 'ti']
+    for i in range(100):
+        selected = rand.sample(columns, rand.randint(1, 4))
+        where = "" if i % 10 else " WHERE i < 0"
+        sql = "SELECT %s FROM t%s" % (', '.join(selected), where)
+        record = random_query(rand, len(selected))
+        record.sql = sql
+        rows = runner.con.execute(sql).fetchall()
+        hash_threshold = rand.choice([0, 100, 10 ** 9])
+        old_string = OldResultHelper(rows, record).value_wise_compare(rows, record, hash_threshold)[1]
+        record.result = old_string
+        runner.con.execute(sql)
+        result = ColumnarResult([array.tolist() for array in runner.fetch_numpy()])
+        assert result.to_rows() == rows
+        assert ResultHelper(result, record).value_wise_compare(result, record, hash_threshold) == \
+            (True, old_string)
+        # and the hashed queries streamed in columnar batches
+        runner.set_columnar()
+        runner.COLUMNAR_BATCH_SIZE = rand.choice([7, 65536])
+        hasher = ResultHasher(record, hash_threshold, rand.choice([1, 10 ** 9]))
+        runner.stream_query(sql, hasher)
+        assert hasher.finish() == (True, old_string)
+    runner.close()
+
+
+def test_in_memory_snapshot(tmp_path):
+    r = main.get_runner('sqlite', in_memory=True, snapshot=True)
+    r.init_dumper(write_files=False)
+    r.init_filter()
+    db_name = str(tmp_path / "tempdb")
+    test_files = [tmp_path / "pass.test", tmp_path / "fail.test"]
+    test_files[0].write_text("statement ok\nCREATE TABLE t1(a INTEGER)\n\nquery I nosort\nSELECT count(*) FROM t1\n----\n0\n")
+    test_files[1].write_text("statement ok\nCREATE TABLE t1(a INTEGER)\n\nstatement ok\nINSERT INTO t1 VALUES(1)\n\n"
+                             "query I nosort\nSELECT count(*) FROM t1\n----\n2\n")
+    for i, test_file in enumerate(test_files):
+        main.run_test_file(testparser.SLTParser(), r, i, str(test_file), db_name, "INFO")
+    # only the failed test file leaves its database, nothing is written for the passed one
+    assert sorted(os.listdir(tmp_path)) == ["fail.test", "pass.test", "tempdb_1.db"]
+    con = sqlite3.connect(str(tmp_path / "tempdb_1.db"))
+    assert con.execute("SELECT a FROM t1").fetchall() == [(1,)]
+    con.close()